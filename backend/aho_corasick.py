@@ -0,0 +1,116 @@
+from collections import deque
+
+
+class PhraseAutomaton:
+    """
+    Aho-Corasick multi-pattern matcher over characters.
+    Patterns are added to and removed from the trie in place. Removing one only
+    empties its key set; adding new nodes marks the failure links stale, and
+    link() recomputes them in one pass without rebuilding the trie. Removed
+    patterns leave dead nodes behind, which are compacted away once they
+    outnumber live ones.
+    """
+
+    def __init__(self):
+        self._reset()
+        self._patterns = {}  # pattern -> set of keys
+        self.rebuilds = 0
+
+    def _reset(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._keys = [None]  # node -> keys of patterns ending there (None: never a pattern end)
+        self._out = [0]      # nearest proper suffix node that is (or was) a pattern end
+        self._dirty = False
+        self._dead_patterns = 0
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def add(self, pattern: str, key):
+        if not pattern:
+            return
+        keys = self._patterns.setdefault(pattern, set())
+        keys.add(key)
+        if len(keys) > 1:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._keys.append(None)
+                self._out.append(0)
+            node = nxt
+        if self._keys[node] is None:
+            # A new pattern end changes output links even if no node was added
+            self._dirty = True
+        else:
+            # Reviving a removed pattern's node
+            self._dead_patterns -= 1
+        self._keys[node] = keys
+
+    def remove(self, pattern: str, key):
+        keys = self._patterns.get(pattern)
+        if keys is None:
+            return
+        keys.discard(key)
+        if keys:
+            return
+        del self._patterns[pattern]
+        # The node keeps its (now empty) key set, so no links change
+        self._dead_patterns += 1
+        if self._dead_patterns > len(self._patterns):
+            self._compact()
+
+    def _compact(self):
+        patterns = self._patterns
+        self._reset()
+        self._patterns = {}
+        for pattern, keys in patterns.items():
+            for key in keys:
+                self.add(pattern, key)
+        self.rebuilds += 1
+
+    @property
+    def stale(self) -> bool:
+        return self._dirty
+
+    def link(self):
+        goto, fail, keys, out = self._goto, self._fail, self._keys, self._out
+        queue = deque()
+        for child in goto[0].values():
+            fail[child] = 0
+            out[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(ch, 0)
+                fail[child] = target if target != child else 0
+                out[child] = fail[child] if keys[fail[child]] is not None else out[fail[child]]
+                queue.append(child)
+        self._dirty = False
+
+    def search(self, text: str) -> set:
+        """Returns the keys of every pattern that occurs in text."""
+        if self._dirty:
+            self.link()
+        goto, fail, keys, out = self._goto, self._fail, self._keys, self._out
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = node if keys[node] is not None else out[node]
+            while hit:
+                found.update(keys[hit])
+                hit = out[hit]
+        return found
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+
+from sqlmodel import Session
+
+from config import settings
+from database import engine
+from metrics import metrics
+from models import AuditLog
+from stats_rollup import apply_rollups, prune_rollups
+
+# How often minute rollups past their retention are deleted
+PRUNE_INTERVAL_S = 60
+
+OVERFLOW_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+
+class AuditWriter:
+    """
+    Write-behind pipeline for AuditLog rows.
+    Requests only enqueue a row; a background task drains the bounded queue and
+    bulk-inserts up to AUDIT_BATCH_SIZE rows per transaction, at least every
+    AUDIT_FLUSH_INTERVAL_MS, updating the stats rollups in the same transaction.
+    When the queue is full the overflow policy decides whether the caller waits
+    (block) or a row is dropped.
+    """
+
+    def __init__(self, db_engine, max_queue: int, batch_size: int, flush_interval_ms: float, overflow: str):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"AUDIT_OVERFLOW must be one of {OVERFLOW_POLICIES}, got {overflow!r}")
+        self.engine = db_engine
+        self.max_queue = max_queue
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000
+        self.overflow = overflow
+        self._queue = None
+        self._worker = None
+        self._stopped = False
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_flush_ms = 0.0
+        self._last_prune = 0.0
+
+    def start(self):
+        self._stopped = False
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Flush everything still queued, then shut the worker down
+        self._stopped = True
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        remaining = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        for i in range(0, len(remaining), self.batch_size):
+            await asyncio.to_thread(self._write, remaining[i:i + self.batch_size])
+
+    async def submit(self, row: dict):
+        self.enqueued += 1
+        if self._stopped:
+            # After stop() nothing drains the queue any more, so late rows are written directly
+            await asyncio.to_thread(self._write, [row])
+            return
+        self.start()
+        if self.overflow == "block":
+            await self._queue.put(row)
+            return
+        if self._queue.full():
+            self.dropped += 1
+            if self.overflow == "drop_newest":
+                return
+            self._queue.get_nowait()
+        self._queue.put_nowait(row)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        batch = []
+        writing = None
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                deadline = loop.time() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    if not self._queue.empty():
+                        batch.append(self._queue.get_nowait())
+                        continue
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                writing = asyncio.ensure_future(asyncio.to_thread(self._write, batch))
+                batch = []
+                # Shielded: a shutdown must not abandon a transaction half-way
+                await asyncio.shield(writing)
+        except asyncio.CancelledError:
+            # Rows already taken off the queue still need writing on shutdown
+            if writing is not None and not writing.done():
+                await writing
+            if batch:
+                await asyncio.to_thread(self._write, batch)
+            raise
+
+    def _write(self, rows):
+        started = time.perf_counter()
+        try:
+            with Session(self.engine) as session:
+                session.execute(AuditLog.__table__.insert(), rows)
+                apply_rollups(session, rows)
+                if started - self._last_prune >= PRUNE_INTERVAL_S:
+                    prune_rollups(session, settings.STATS_MINUTE_RETENTION_HOURS)
+                    self._last_prune = started
+                session.commit()
+        except Exception as e:
+            self.failed += len(rows)
+            print(f"ERROR: Failed to save {len(rows)} logs: {e}")
+            return
+        self.written += len(rows)
+        self.batches += 1
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        metrics.observe("gateway_stage_seconds", self.last_flush_ms / 1000, stage="audit_write")
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "overflow": self.overflow,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "mean_batch_size": (self.written / self.batches) if self.batches else 0,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+
+def audit_row(user_input: str, response: str, risk_score: float, risk_details: dict, action: str, latency: float,
+              decided_by: str = "model", blocked_category: str = None, stage_timings: dict = None) -> dict:
+    return {
+        "timestamp": datetime.utcnow(),
+        "user_input": user_input,
+        "model_response": response,
+        "risk_score": risk_score,
+        "risk_details": json.dumps(risk_details),
+        "action": action,
+        "latency_ms": latency,
+        "decided_by": decided_by,
+        "blocked_category": blocked_category,
+        "stage_timings": json.dumps({stage: round(ms, 3) for stage, ms in stage_timings.items()}) if stage_timings else None,
+    }
+
+
+audit_writer = AuditWriter(
+    engine,
+    settings.AUDIT_QUEUE_SIZE,
+    settings.AUDIT_BATCH_SIZE,
+    settings.AUDIT_FLUSH_INTERVAL_MS,
+    settings.AUDIT_OVERFLOW,
+)
@@ -0,0 +1,243 @@
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import settings
+from metrics import metrics
+
+
+class GuardUnavailable(Exception):
+    """The guard could not produce a verdict in time; carries a Retry-After hint in seconds."""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GuardOverloaded(GuardUnavailable):
+    """Rejected up front because too many checks are already queued or running."""
+
+
+def _merge_windows(risk_maps, decision):
+    # One risk map per conversation: each category's worst score across its windows
+    if len(risk_maps) == 1:
+        risk_map = risk_maps[0]
+    else:
+        risk_map = {}
+        for window_map in risk_maps:
+            for category, score in window_map.items():
+                risk_map[category] = max(score, risk_map.get(category, 0.0))
+        risk_map = dict(sorted(risk_map.items(), key=lambda item: item[1], reverse=True))
+    if decision:
+        # Underscore keys are metadata, not categories; policy checks ignore them
+        risk_map["_context"] = decision
+    return risk_map
+
+
+class InferenceBatcher:
+    """
+    Groups concurrent guard checks into micro-batches.
+    Callers await infer() as if it were SafetyEngine.infer; queued requests are
+    collected until BATCH_MAX_SIZE is reached or BATCH_MAX_WAIT_MS has passed
+    since the first one arrived, then scored in a single padded model call.
+    """
+
+    def __init__(self, engine, max_batch_size: int, max_wait_ms: float, max_pending: int = 0):
+        self.engine = engine
+        # Admission control: checks queued or running at once (0 = unbounded)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue = None
+        self._worker = None
+        # A single model thread keeps batches ordered and leaves the event loop
+        # free to collect the next batch while the current one runs.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="guard-batch")
+
+        self.total_batches = 0
+        self.total_requests = 0
+        self.size_histogram = {}
+        self.total_wait_ms = 0.0
+        self.total_infer_ms = 0.0
+        self.last_batch_size = 0
+        # Offline (bulk) batches, kept apart from the live occupancy figures
+        self.bulk_batches = 0
+        self.bulk_requests = 0
+        self.bulk_infer_ms = 0.0
+
+    async def infer(self, messages, check_response=False):
+        if self.engine is None:
+            raise GuardUnavailable("Guard model is still loading", retry_after=5)
+        # Planning tokenizes the whole conversation, so it runs on the model thread too
+        rendered, decision, timings = await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._plan, messages, check_response
+        )
+        metrics.merge(timings)
+        if len(rendered) == 1:
+            return _merge_windows([await self.infer_rendered(rendered[0])], decision)
+        # Windows are queued together so they share batches
+        return _merge_windows(await asyncio.gather(*(self.infer_rendered(r) for r in rendered)), decision)
+
+    async def infer_many(self, conversations, batch_size: int = 0) -> list:
+        """
+        Scores [(messages, check_response), ...] for offline jobs.
+        Rendered inputs go to the model thread as pre-formed batches of up to
+        batch_size (default: one per call), bypassing the micro-batch queue; they
+        run in turn with live batches on the same thread.
+        """
+        if self.engine is None:
+            raise GuardUnavailable("Guard model is still loading", retry_after=5)
+        loop = asyncio.get_running_loop()
+        plans, rendered = [], []
+        for messages, check_response in conversations:
+            windows, decision, _ = await loop.run_in_executor(self._executor, self._plan, messages, check_response)
+            plans.append((len(rendered), len(windows), decision))
+            rendered.extend(windows)
+
+        batch_size = batch_size or len(rendered) or 1
+        risk_maps = []
+        for i in range(0, len(rendered), batch_size):
+            chunk = rendered[i:i + batch_size]
+            started = time.perf_counter()
+            risk_maps.extend(await loop.run_in_executor(self._executor, self.engine.infer_batch, chunk))
+            self.bulk_batches += 1
+            self.bulk_requests += len(chunk)
+            self.bulk_infer_ms += (time.perf_counter() - started) * 1000
+        return [_merge_windows(risk_maps[start:start + count], decision) for start, count, decision in plans]
+
+    async def infer_rendered(self, rendered_query: str) -> dict:
+        if self.engine is None:
+            raise GuardUnavailable("Guard model is still loading", retry_after=5)
+        if self.max_pending and self.pending >= self.max_pending:
+            self.rejected += 1
+            raise GuardOverloaded(f"Guard queue is full ({self.pending} checks pending)", self.retry_after())
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self.pending += 1
+        try:
+            await self._queue.put((rendered_query, future, time.perf_counter()))
+            risk_map, timings = await future
+            metrics.merge(timings)
+            return risk_map
+        finally:
+            self.pending -= 1
+
+    def retry_after(self) -> int:
+        # Rough time to drain the current backlog, in whole seconds
+        if not self.total_batches:
+            return 1
+        batches_ahead = self.pending / self.max_batch_size
+        return max(1, math.ceil(batches_ahead * self.total_infer_ms / self.total_batches / 1000))
+
+    def _ensure_started(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    # Still drain whatever is already queued without waiting
+                    if self._queue.empty():
+                        break
+                    batch.append(self._queue.get_nowait())
+                    continue
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Drop callers that went away while queued (e.g. client disconnect)
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                risk_maps, batch_timings = await loop.run_in_executor(
+                    self._executor, self._infer_batch, [item[0] for item in batch]
+                )
+            except Exception as e:
+                print(f"ERROR: Batch inference failed: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            self._record(batch, started, finished)
+            batch_timings["guard_batch"] = (finished - started) * 1000
+            for (_, future, enqueued), risk_map in zip(batch, risk_maps):
+                if not future.done():
+                    future.set_result((risk_map, {**batch_timings, "guard_queue_wait": (started - enqueued) * 1000}))
+
+    def _plan(self, messages, check_response):
+        # Runs on the model thread, so the tokenizer is never used from two threads at once
+        timings = metrics.begin_request()
+        with metrics.span("guard_context"):
+            conversations, decision = self.engine.context.plan(messages)
+            rendered = [self.engine.render(c, check_response) for c in conversations]
+        return rendered, decision, timings
+
+    def _infer_batch(self, rendered_queries):
+        # Runs on the model thread, which does not share the callers' contextvars: the
+        # engine's spans are collected per batch and handed back to every request in it
+        timings = metrics.begin_request()
+        return self.engine.infer_batch(rendered_queries), timings
+
+    def _record(self, batch, started, finished):
+        size = len(batch)
+        self.total_batches += 1
+        self.total_requests += size
+        self.size_histogram[size] = self.size_histogram.get(size, 0) + 1
+        self.total_wait_ms += sum((started - enqueued) * 1000 for _, _, enqueued in batch)
+        self.total_infer_ms += (finished - started) * 1000
+        for _, _, enqueued in batch:
+            metrics.observe("gateway_stage_seconds", started - enqueued, stage="guard_queue_wait")
+        metrics.observe("gateway_stage_seconds", finished - started, stage="guard_batch")
+        self.last_batch_size = size
+
+    def stats(self) -> dict:
+        batches = self.total_batches or 1
+        requests = self.total_requests or 1
+        mean_size = self.total_requests / batches
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.total_batches,
+            "requests": self.total_requests,
+            "mean_batch_size": mean_size,
+            "occupancy": mean_size / self.max_batch_size,
+            "last_batch_size": self.last_batch_size,
+            "batch_size_histogram": dict(sorted(self.size_histogram.items())),
+            "bulk_batches": self.bulk_batches,
+            "bulk_requests": self.bulk_requests,
+            "bulk_mean_batch_infer_ms": self.bulk_infer_ms / (self.bulk_batches or 1),
+            "mean_queue_wait_ms": self.total_wait_ms / requests,
+            "mean_batch_infer_ms": self.total_infer_ms / batches,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+        }
+
+
+# The engine is attached by model_loader once the model is loaded and warm
+batcher = InferenceBatcher(None, settings.BATCH_MAX_SIZE, settings.BATCH_MAX_WAIT_MS, settings.GUARD_MAX_PENDING)
@@ -0,0 +1,88 @@
+"""
+Sustained audit-log write throughput: per-request commits vs the batched writer.
+
+Writes the same rows into two scratch SQLite databases, once the old way (new
+Session, one INSERT and one COMMIT per row) and once through AuditWriter fed by
+concurrent producers, and reports rows/s for each.
+
+    cd backend
+    python benchmarks/audit_throughput.py [--rows 20000] [--producers 50]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlmodel import Session, SQLModel, select, func  # noqa: E402
+
+from audit_writer import AuditWriter, audit_row  # noqa: E402
+from config import settings  # noqa: E402
+from database import make_engine  # noqa: E402
+from models import AuditLog  # noqa: E402
+
+RISK_DETAILS = {"sec": 0.91, "dw": 0.02, "pc": 0.01}
+
+
+def sample_row(i):
+    return audit_row(f"user prompt {i}", "assistant reply " * 20, 0.0, RISK_DETAILS, "allow", 12.5)
+
+
+def count(db_engine):
+    with Session(db_engine) as session:
+        return session.exec(select(func.count(AuditLog.id))).one()
+
+
+def per_request(db_engine, rows):
+    started = time.perf_counter()
+    for i in range(rows):
+        with Session(db_engine) as session:
+            session.add(AuditLog(**sample_row(i)))
+            session.commit()
+    return time.perf_counter() - started
+
+
+async def batched(db_engine, rows, producers):
+    writer = AuditWriter(
+        db_engine, settings.AUDIT_QUEUE_SIZE, settings.AUDIT_BATCH_SIZE,
+        settings.AUDIT_FLUSH_INTERVAL_MS, "block",
+    )
+    started = time.perf_counter()
+
+    async def produce(offset):
+        for i in range(offset, rows, producers):
+            await writer.submit(sample_row(i))
+
+    await asyncio.gather(*[produce(p) for p in range(producers)])
+    await writer.stop()
+    return time.perf_counter() - started, writer.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--producers", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old_engine = make_engine(f"sqlite:///{os.path.join(tmp, 'per_request.db')}")
+        new_engine = make_engine(f"sqlite:///{os.path.join(tmp, 'batched.db')}")
+        SQLModel.metadata.create_all(old_engine)
+        SQLModel.metadata.create_all(new_engine)
+
+        old_s = per_request(old_engine, args.rows)
+        new_s, stats = asyncio.run(batched(new_engine, args.rows, args.producers))
+
+        print(f"per-request commits: {count(old_engine)} rows in {old_s:.2f}s ({args.rows / old_s:,.0f} rows/s)")
+        print(f"batched writer:      {count(new_engine)} rows in {new_s:.2f}s ({args.rows / new_s:,.0f} rows/s)")
+        print(f"speedup:             {old_s / new_s:.1f}x")
+        print(f"writer stats:        {stats}")
+        old_engine.dispose()
+        new_engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Latency and throughput report for guard model backends.
+
+Loads each backend in turn (Settings.DEVICE values, e.g. "cpu" and "cpu-int8"),
+warms it up, then scores the parity corpus at each batch size and prints load
+time, p50/p95 batch latency and checks per second.
+
+    cd backend
+    python benchmarks/backend_latency.py [--backends cpu,cpu-int8] [--batch-sizes 1,8] [--iterations 20]
+
+Set CPU_THREADS to see how the thread count changes the CPU numbers.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch  # noqa: E402
+
+from benchmarks.parity import render_corpus  # noqa: E402
+from safety_engine import SafetyEngine  # noqa: E402
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def measure(engine, rendered, batch_size, iterations):
+    latencies = []
+    checks = 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        batch = [rendered[(i * batch_size + j) % len(rendered)] for j in range(batch_size)]
+        batch_started = time.perf_counter()
+        engine.infer_batch(batch)
+        latencies.append((time.perf_counter() - batch_started) * 1000)
+        checks += batch_size
+    elapsed = time.perf_counter() - started
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": percentile(latencies, 0.95),
+        "checks_per_s": checks / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", default="cpu,cpu-int8")
+    parser.add_argument("--batch-sizes", default="1,8")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+
+    rows = []
+    for backend in args.backends.split(","):
+        started = time.perf_counter()
+        engine = SafetyEngine(backend)
+        load_s = time.perf_counter() - started
+        rendered = render_corpus(engine)
+        engine.prefix_cache.max_bytes = 0  # measure full prefill, not KV reuse
+        engine.infer_batch(rendered[:max(batch_sizes)])
+        for batch_size in batch_sizes:
+            rows.append((backend, load_s, batch_size, measure(engine, rendered, batch_size, args.iterations)))
+        del engine
+
+    print(f"torch threads: {torch.get_num_threads()}")
+    print(f"{'backend':<10} {'load s':>7} {'batch':>5} {'p50 ms':>9} {'p95 ms':>9} {'checks/s':>9}")
+    for backend, load_s, batch_size, result in rows:
+        print(f"{backend:<10} {load_s:>7.2f} {batch_size:>5} {result['p50_ms']:>9.1f} "
+              f"{result['p95_ms']:>9.1f} {result['checks_per_s']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
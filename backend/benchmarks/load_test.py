@@ -0,0 +1,394 @@
+"""
+Reproducible load test of the whole gateway against a local mock upstream.
+
+Builds (or reuses) the tiny guard model from tiny_model.py, starts
+mock_upstream.py and the gateway as subprocesses in a scratch directory (fresh
+database, no .env), then drives a seeded request mix at fixed concurrency:
+
+    --prompt-words  lengths of the final user message, in words (picked uniformly)
+    --turns         conversation lengths; earlier turns get short filler exchanges
+    --stream-share  fraction of streaming requests
+    --block-rate    fraction of prompts carrying a marker phrase that a pre-filter
+                    deny rule blocks (the random model's scores stay under the
+                    default thresholds, so it blocks almost nothing by itself)
+
+Reports p50/p95/p99 latency (all, blocking, streaming, blocked), streaming
+time-to-first-byte, throughput, the gateway's event-loop lag, its memory and
+guard batch occupancy, as JSON. With --baseline the run is compared against an
+earlier result file, and the exit status is 1 if any metric regressed by more
+than --tolerance.
+
+    cd backend
+    python benchmarks/load_test.py --duration 30 --concurrency 32 --out baseline.json
+    python benchmarks/load_test.py --duration 30 --concurrency 32 --out run.json --baseline baseline.json
+
+Gateway settings can be overridden with --gateway-env KEY=VALUE (repeatable),
+e.g. --gateway-env STREAM_MODERATION=false --gateway-env BATCH_MAX_SIZE=16.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from importlib import metadata
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import httpx  # noqa: E402
+
+from benchmarks.tiny_model import WORDS, ensure as ensure_tiny_model  # noqa: E402
+
+BLOCK_MARKER = "loadtest deny marker"
+
+# (path in the result file, True if higher is better)
+COMPARED_METRICS = (
+    ("throughput_rps", True),
+    ("latency_ms.all.p50", False),
+    ("latency_ms.all.p95", False),
+    ("latency_ms.all.p99", False),
+    ("latency_ms.blocking.p95", False),
+    ("latency_ms.stream.p95", False),
+    ("stream_ttfb_ms.p95", False),
+    ("loop_lag_ms.p99", False),
+    ("memory_mb.peak", False),
+)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": rank(50),
+        "p95": rank(95),
+        "p99": rank(99),
+        "max": ordered[-1],
+    }
+
+
+def rss_mb(pid: int):
+    # Resident memory of the gateway process (Linux /proc, else psutil if installed)
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / 1024 / 1024
+    except Exception:
+        return None
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def next_request(rng: random.Random, args) -> dict:
+    turns = rng.choice(args.turns)
+    messages = [{"role": "system", "content": "you are a helpful assistant"}]
+    for _ in range(turns - 1):
+        messages.append({"role": "user", "content": sentence(rng, rng.randint(8, 40))})
+        messages.append({"role": "assistant", "content": sentence(rng, rng.randint(20, 80))})
+    prompt = sentence(rng, rng.choice(args.prompt_words))
+    if rng.random() < args.block_rate:
+        prompt += " " + BLOCK_MARKER
+    return {"model": "mock", "messages": messages + [{"role": "user", "content": prompt}],
+            "stream": rng.random() < args.stream_share}
+
+
+async def send(client: httpx.AsyncClient, url: str, payload: dict) -> dict:
+    started = time.perf_counter()
+    first_byte = None
+    body = b""
+    try:
+        if payload["stream"]:
+            async with client.stream("POST", url, json=payload) as response:
+                async for data in response.aiter_bytes():
+                    if first_byte is None:
+                        first_byte = time.perf_counter()
+                    body += data
+                status = response.status_code
+        else:
+            response = await client.post(url, json=payload)
+            first_byte = time.perf_counter()
+            body = response.content
+            status = response.status_code
+    except httpx.HTTPError as e:
+        return {"stream": payload["stream"], "status": 0, "error": type(e).__name__,
+                "latency_ms": (time.perf_counter() - started) * 1000}
+    finished = time.perf_counter()
+    return {
+        "stream": payload["stream"],
+        "status": status,
+        "blocked": b"BLOCKED:" in body,
+        "latency_ms": (finished - started) * 1000,
+        "ttfb_ms": ((first_byte or finished) - started) * 1000,
+    }
+
+
+async def drive(args, base_url: str, gateway_pid: int) -> dict:
+    url = f"{base_url}/v1/chat/completions"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.request_timeout, limits=limits) as client:
+        response = await client.post(f"{base_url}/api/filters", json={
+            "kind": "phrase", "action": "deny", "pattern": BLOCK_MARKER, "risk_category": "dw", "note": "load test",
+        })
+        response.raise_for_status()
+
+        async def run_phase(seconds, seed_offset, records):
+            deadline = time.perf_counter() + seconds
+
+            async def worker(idx):
+                rng = random.Random(args.seed * 100003 + seed_offset + idx)
+                while time.perf_counter() < deadline:
+                    result = await send(client, url, next_request(rng, args))
+                    if records is not None:
+                        records.append(result)
+
+            await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+
+        if args.warmup > 0:
+            await run_phase(args.warmup, 50000, None)
+
+        memory = []
+
+        async def sample_memory():
+            while True:
+                value = rss_mb(gateway_pid)
+                if value is not None:
+                    memory.append(value)
+                await asyncio.sleep(0.25)
+
+        records = []
+        sampler = asyncio.create_task(sample_memory())
+        started = time.perf_counter()
+        await run_phase(args.duration, 0, records)
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+
+        loop_stats = (await client.get(f"{base_url}/api/loop/stats")).json()
+        engine_stats = (await client.get(f"{base_url}/api/engine/stats")).json()
+
+    ok = [r for r in records if r["status"] == 200]
+    return {
+        "requests": len(records),
+        "ok": len(ok),
+        "rejected": sum(1 for r in records if r["status"] == 503),
+        "errors": sum(1 for r in records if r["status"] not in (200, 503)),
+        "duration_s": elapsed,
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "block_rate": (sum(1 for r in ok if r["blocked"]) / len(ok)) if ok else 0.0,
+        "latency_ms": {
+            "all": percentiles([r["latency_ms"] for r in ok]),
+            "blocking": percentiles([r["latency_ms"] for r in ok if not r["stream"] and not r["blocked"]]),
+            "stream": percentiles([r["latency_ms"] for r in ok if r["stream"] and not r["blocked"]]),
+            "blocked": percentiles([r["latency_ms"] for r in ok if r["blocked"]]),
+        },
+        "stream_ttfb_ms": percentiles([r["ttfb_ms"] for r in ok if r["stream"] and not r["blocked"]]),
+        "loop_lag_ms": {
+            "p50": loop_stats.get("lag_p50_ms", 0.0),
+            "p99": loop_stats.get("lag_p99_ms", 0.0),
+            "max": loop_stats.get("lag_max_window_ms", 0.0),
+        },
+        "memory_mb": {
+            "start": memory[0] if memory else None,
+            "peak": max(memory) if memory else None,
+            "end": memory[-1] if memory else None,
+        },
+        "guard": {
+            "batches": engine_stats.get("batches"),
+            "mean_batch_size": engine_stats.get("mean_batch_size"),
+        },
+    }
+
+
+def lookup(results: dict, path: str):
+    value = results
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Prints a metric-by-metric comparison; returns the metrics that regressed."""
+    if current["config"] != baseline.get("config"):
+        print("WARNING: baseline was recorded with a different configuration")
+    regressions = []
+    print(f"\n{'metric':<26} {'baseline':>12} {'current':>12} {'change':>9}")
+    for path, higher_is_better in COMPARED_METRICS:
+        old, new = lookup(baseline.get("results", {}), path), lookup(current["results"], path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        regressed = change < -tolerance if higher_is_better else change > tolerance
+        if regressed:
+            regressions.append(path)
+        print(f"{path:<26} {old:>12.2f} {new:>12.2f} {change:>+8.1%}{'  REGRESSED' if regressed else ''}")
+    return regressions
+
+
+def wait_ready(base_url: str, process: subprocess.Popen, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gateway exited with status {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/readyz", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"gateway not ready after {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="guard model directory (default: build the tiny model once and reuse it)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before the run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--prompt-words", type=lambda s: [int(x) for x in s.split(",")], default=[16, 128, 512])
+    parser.add_argument("--turns", type=lambda s: [int(x) for x in s.split(",")], default=[1, 1, 3, 8])
+    parser.add_argument("--stream-share", type=float, default=0.3)
+    parser.add_argument("--block-rate", type=float, default=0.1)
+    parser.add_argument("--upstream-latency-ms", type=float, default=50.0)
+    parser.add_argument("--upstream-tokens", type=int, default=64)
+    parser.add_argument("--upstream-token-rate", type=float, default=0.0, help="streamed tokens/s, 0 for unthrottled")
+    parser.add_argument("--gateway-env", action="append", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--ready-timeout", type=float, default=180.0)
+    parser.add_argument("--out", help="write the JSON result here (default: stdout)")
+    parser.add_argument("--baseline", help="earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative change before a metric counts as regressed")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory (gateway log and database)")
+    args = parser.parse_args()
+
+    model = args.model or ensure_tiny_model()
+
+    gateway_env = dict(item.split("=", 1) for item in args.gateway_env)
+    config = {
+        key: value for key, value in vars(args).items()
+        if key not in ("out", "baseline", "tolerance", "keep", "request_timeout", "ready_timeout", "gateway_env")
+    }
+    config["model"] = model
+    config["gateway_env"] = gateway_env
+
+    workdir = tempfile.mkdtemp(prefix="llm-guard-load-")
+    mock_port, gateway_port = free_port(), free_port()
+    base_url = f"http://127.0.0.1:{gateway_port}"
+    log_path = os.path.join(workdir, "gateway.log")
+    processes = []
+    try:
+        processes.append(subprocess.Popen([
+            sys.executable, os.path.join(BENCH_DIR, "mock_upstream.py"), "--port", str(mock_port),
+            "--latency-ms", str(args.upstream_latency_ms), "--tokens", str(args.upstream_tokens),
+            "--token-rate", str(args.upstream_token_rate),
+        ], cwd=workdir))
+        env = {
+            **os.environ,
+            "MODEL_PATH": model,
+            "DEVICE": "cpu",
+            "UPSTREAM_API_BASE": f"http://127.0.0.1:{mock_port}/v1",
+            "LOOP_LAG_INTERVAL_MS": "50",
+            **gateway_env,
+        }
+        launch = (
+            f"import sys; sys.path.insert(0, {BACKEND_DIR!r}); import uvicorn, main; "
+            f"uvicorn.run(main.app, host='127.0.0.1', port={gateway_port}, log_level='warning')"
+        )
+        with open(log_path, "w") as log:
+            gateway = subprocess.Popen([sys.executable, "-c", launch], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        processes.append(gateway)
+        wait_ready(base_url, gateway, args.ready_timeout)
+
+        results = asyncio.run(drive(args, base_url, gateway.pid))
+    except Exception:
+        if os.path.exists(log_path):
+            with open(log_path) as f:
+                print("--- gateway log ---\n" + f.read()[-4000:], file=sys.stderr)
+        raise
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if args.keep:
+            print(f"Scratch directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def version(package):
+        try:
+            return metadata.version(package)
+        except metadata.PackageNotFoundError:
+            return None
+
+    report = {
+        "version": 1,
+        "recorded_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "config": config,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "torch": version("torch"),
+            "transformers": version("transformers"),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    latency = results["latency_ms"]["all"]
+    print(
+        f"\n{results['ok']}/{results['requests']} ok ({results['rejected']} rejected, {results['errors']} errors), "
+        f"{results['throughput_rps']:.1f} req/s, latency p50 {latency['p50']:.1f} ms / p95 {latency['p95']:.1f} ms / "
+        f"p99 {latency['p99']:.1f} ms, loop lag p99 {results['loop_lag_ms']['p99']:.1f} ms, "
+        f"peak RSS {results['memory_mb']['peak'] or 0:.0f} MB",
+        file=sys.stderr if not args.out else sys.stdout,
+    )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Local OpenAI-compatible upstream for exercising the gateway without a real LLM.
+
+Serves POST /v1/chat/completions in blocking and streaming (SSE) form with a
+configurable response latency, reply length and token rate, and can inject
+failures to exercise retries and backend ejection.
+
+    cd backend
+    python benchmarks/mock_upstream.py --port 9100 --latency-ms 200 --tokens 64 --token-rate 50
+
+then point the gateway at it with UPSTREAM_API_BASE=http://127.0.0.1:9100/v1.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "the gateway forwards this reply token by token so that streaming relays "
+    "and moderation windows can be measured under a realistic token rate"
+).split()
+
+
+def create_app(latency_ms: float = 0.0, tokens: int = 64, token_rate: float = 0.0,
+               fail_rate: float = 0.0, reply: str = None) -> FastAPI:
+    """
+    latency_ms: delay before the response (blocking) or before the first chunk (streaming)
+    token_rate: streamed tokens per second, 0 for as fast as possible
+    fail_rate: fraction of requests answered with HTTP 503
+    reply: fixed reply text instead of generated filler
+    """
+    app = FastAPI(title="Mock OpenAI Upstream")
+    app.state.requests = 0
+
+    def reply_tokens():
+        if reply is not None:
+            return [word + " " for word in reply.split()]
+        return [WORDS[i % len(WORDS)] + " " for i in range(tokens)]
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.requests += 1
+        body = await request.json()
+        model = body.get("model", "mock")
+        if fail_rate and random.random() < fail_rate:
+            return JSONResponse({"error": {"message": "injected failure"}}, status_code=503)
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+
+        completion_id = f"chatcmpl-{uuid.uuid4()}"
+        created = int(time.time())
+        pieces = reply_tokens()
+
+        if not body.get("stream"):
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(pieces), "total_tokens": len(pieces)},
+            }
+
+        async def events():
+            delay = 1 / token_rate if token_rate else 0
+            for piece in pieces:
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if delay:
+                    await asyncio.sleep(delay)
+            done = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--token-rate", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    app = create_app(args.latency_ms, args.tokens, args.token_rate, args.fail_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Measures KV prefix reuse across a multi-turn conversation.
+
+Replays a synthetic N-turn chat the way the proxy checks it (prompt check with
+the full history, then response check with the reply appended) once with the
+prefix cache disabled and once enabled, and reports prefilled tokens, wall time
+and the largest score difference between the two runs.
+
+    cd backend
+    python benchmarks/prefix_reuse.py [--turns 20]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from safety_engine import SafetyEngine  # noqa: E402
+
+safety_engine = SafetyEngine()
+
+USER_TURNS = [
+    "Can you help me plan a weekend trip to Hangzhou?",
+    "What should I pack if it might rain?",
+    "Which tea houses near West Lake are worth visiting?",
+    "How do I get from the train station to the lake?",
+    "Any tips for avoiding the crowds?",
+]
+ASSISTANT_TURN = "Sure. Here are a few suggestions, with some detail on each so you can decide what suits you best. " * 3
+
+
+def replay(turns):
+    history = [{"role": "system", "content": "You are a helpful travel assistant."}]
+    total_tokens = 0
+    results = []
+    started = time.perf_counter()
+    for turn in range(turns):
+        history.append({"role": "user", "content": USER_TURNS[turn % len(USER_TURNS)]})
+        for check_response in (False, True):
+            if check_response:
+                history.append({"role": "assistant", "content": ASSISTANT_TURN})
+            rendered = safety_engine.render(history, check_response=check_response)
+            total_tokens += len(safety_engine.tokenizer(rendered)["input_ids"])
+            results.extend(safety_engine.infer_batch([rendered]))
+    return results, total_tokens, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    cache = safety_engine.prefix_cache
+    budget = cache.max_bytes
+    if safety_engine.scoring_mode != "forward" or not budget:
+        sys.exit("Prefix reuse needs SCORING_MODE=forward and PREFIX_CACHE_MAX_MB > 0")
+
+    cache.max_bytes = 0
+    baseline, total_tokens, baseline_s = replay(args.turns)
+
+    cache.max_bytes = budget
+    cache.clear()
+    cache.reused_tokens = cache.prefilled_tokens = 0
+    reused, _, reused_s = replay(args.turns)
+
+    max_diff = max(
+        abs(a.get(k, 0.0) - b.get(k, 0.0)) for a, b in zip(baseline, reused) for k in a
+    )
+    prefilled = cache.prefilled_tokens
+    print(f"turns:                 {args.turns} ({2 * args.turns} checks)")
+    print(f"tokens scored:         {total_tokens}")
+    print(f"prefilled w/o reuse:   {total_tokens}  ({baseline_s * 1000:.1f} ms)")
+    print(f"prefilled with reuse:  {prefilled}  ({reused_s * 1000:.1f} ms)")
+    print(f"prefill savings:       {1 - prefilled / total_tokens:.1%}")
+    print(f"cache:                 {cache.stats()}")
+    print(f"max score difference:  {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
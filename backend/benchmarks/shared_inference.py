@@ -0,0 +1,95 @@
+"""
+Exercises the shared inference server with several client processes.
+
+Starts inference_server.py as a subprocess, then runs --workers client processes
+that each send --requests checks with --concurrency in flight, the way separate
+uvicorn workers would. Prints throughput and the server's batch stats, which
+show checks from different workers landing in the same batch.
+
+    cd backend
+    MODEL_PATH=... DEVICE=cpu python benchmarks/shared_inference.py [--workers 4]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def messages_for(worker, i):
+    return [{"role": "user", "content": f"Worker {worker} asks question number {i} about the weather."}]
+
+
+async def drive(socket_path, worker, requests, concurrency):
+    from inference_client import InferenceClient
+
+    client = InferenceClient(socket_path, connections=2)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await client.infer(messages_for(worker, i))
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    await client.close()
+
+
+def worker_main(socket_path, worker, requests, concurrency):
+    asyncio.run(drive(socket_path, worker, requests, concurrency))
+
+
+async def server_stats(socket_path):
+    from inference_client import InferenceClient
+
+    client = InferenceClient(socket_path)
+    stats = await client.stats()
+    await client.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default="/tmp/llm-guard-bench.sock")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    os.environ["INFERENCE_SERVER_SOCKET"] = args.socket
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    server = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, "inference_server.py")], cwd=BACKEND_DIR)
+    try:
+        while not os.path.exists(args.socket):
+            if server.poll() is not None:
+                sys.exit("inference server exited during startup")
+            time.sleep(0.1)
+
+        started = time.perf_counter()
+        workers = [
+            multiprocessing.Process(target=worker_main, args=(args.socket, w, args.requests, args.concurrency))
+            for w in range(args.workers)
+        ]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+        elapsed = time.perf_counter() - started
+
+        total = args.workers * args.requests
+        stats = asyncio.run(server_stats(args.socket))
+        print(f"{total} checks from {args.workers} workers in {elapsed:.2f}s ({total / elapsed:.1f} checks/s)")
+        print(f"server batches: {stats['batches']}  mean batch size: {stats['mean_batch_size']:.2f}")
+        print(f"batch size histogram: {stats['batch_size_histogram']}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
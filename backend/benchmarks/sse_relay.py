@@ -0,0 +1,147 @@
+"""
+Compares the per-token cost of relaying a streamed completion.
+
+Starts mock_upstream.py in its own process (so its CPU is not counted), then
+streams the same completions through two relay loops without moderation:
+
+    lines  the previous relay: aiter_lines, json.loads per event, re-encoded lines
+    bytes  the current relay: raw chunks cut at event boundaries by SSEDeltaParser
+
+and prints CPU microseconds per token and per-chunk relay latency (chunk in
+from the upstream to write out) for each.
+
+    cd backend
+    python benchmarks/sse_relay.py [--streams 200] [--concurrency 50] [--tokens 256] [--token-rate 0]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sse import SSEDeltaParser  # noqa: E402
+from upstream import UpstreamBackend, UpstreamPool  # noqa: E402
+
+
+async def relay_lines(response, latencies):
+    chunks = []
+    written = 0
+    async for line in response.aiter_lines():
+        received = time.perf_counter()
+        if line.startswith("data: ") and line[6:] != "[DONE]":
+            try:
+                delta = json.loads(line[6:])["choices"][0].get("delta", {})
+                if delta.get("content"):
+                    chunks.append(delta["content"])
+            except Exception:
+                pass
+        written += len((line + "\n").encode())
+        latencies.append(time.perf_counter() - received)
+    return "".join(chunks), written
+
+
+async def relay_bytes(response, latencies):
+    chunks = []
+    written = 0
+    parser = SSEDeltaParser()
+    async for data in response.aiter_bytes():
+        received = time.perf_counter()
+        events, deltas = parser.feed(data)
+        chunks.extend(deltas)
+        written += len(events)
+        latencies.append(time.perf_counter() - received)
+    events, deltas = parser.flush()
+    chunks.extend(deltas)
+    return "".join(chunks), written + len(events)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else 0.0
+
+
+async def measure(pool, relay, args, payload):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    replies = []
+
+    async def one():
+        async with semaphore:
+            async with pool.stream(payload) as response:
+                replies.append(await relay(response, latencies))
+
+    cpu, wall = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.streams)))
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    tokens = args.streams * args.tokens
+    return {
+        "cpu_us_per_token": cpu / tokens * 1e6,
+        "chunks": len(latencies),
+        "chunk_latency_p50_us": percentile(latencies, 50) * 1e6,
+        "chunk_latency_p99_us": percentile(latencies, 99) * 1e6,
+        "wall_s": wall,
+    }, replies
+
+
+def wait_for_port(port, timeout=15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.05)
+    raise RuntimeError(f"mock upstream did not start on port {port}")
+
+
+async def run(args):
+    pool = UpstreamPool([UpstreamBackend(f"http://127.0.0.1:{args.port}/v1", "sk-mock")])
+    await pool.start()
+    payload = {"model": "mock", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+    try:
+        # One untimed round warms connections and imports
+        await measure(pool, relay_bytes, argparse.Namespace(**{**vars(args), "streams": args.concurrency}), payload)
+        results = {}
+        for name, relay in (("lines", relay_lines), ("bytes", relay_bytes)):
+            results[name], replies = await measure(pool, relay, args, payload)
+            assert len({text for text, _ in replies}) == 1, f"{name}: replies differ between streams"
+    finally:
+        await pool.close()
+
+    print(f"{args.streams} streams x {args.tokens} tokens, concurrency {args.concurrency}, token rate {args.token_rate or 'unlimited'}")
+    print(f"{'relay':<6} {'cpu us/token':>13} {'chunks':>8} {'p50 us/chunk':>13} {'p99 us/chunk':>13} {'wall s':>8}")
+    for name, r in results.items():
+        print(f"{name:<6} {r['cpu_us_per_token']:>13.2f} {r['chunks']:>8} {r['chunk_latency_p50_us']:>13.1f} "
+              f"{r['chunk_latency_p99_us']:>13.1f} {r['wall_s']:>8.2f}")
+    base = results["lines"]["cpu_us_per_token"]
+    if base:
+        print(f"bytes relay uses {results['bytes']['cpu_us_per_token'] / base:.0%} of the line relay's CPU per token")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--tokens", type=int, default=256)
+    parser.add_argument("--token-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=9150)
+    args = parser.parse_args()
+
+    mock = subprocess.Popen([
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_upstream.py"),
+        "--port", str(args.port), "--tokens", str(args.tokens), "--token-rate", str(args.token_rate),
+    ])
+    try:
+        wait_for_port(args.port)
+        asyncio.run(run(args))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Builds a tiny, randomly initialised stand-in for the guard model.
+
+The result loads through SafetyEngine like the real checkpoint (same id2risk
+map, risk codes as single vocab tokens, a chat template) but has a few
+thousand parameters per layer, so load tests and CI run on a CPU-only box
+without downloading weights. Scores are meaningless; only the cost shape is.
+
+    cd backend
+    python benchmarks/tiny_model.py /tmp/tiny-guard [--layers 2] [--hidden 64]
+    python benchmarks/tiny_model.py /tmp/tiny-guard --tokenizer /path/to/YuFeng-XGuard-Reason-0.6B
+
+Without --tokenizer a byte-level BPE whose merges cover WORDS is generated
+(exactly one token per word). With it, the real tokenizer and architecture are reused, so
+token counts match production exactly; only the layer sizes shrink.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from risk_codes import RISK_CODES  # noqa: E402
+
+# Where ensure() builds the model; the suffix is bumped whenever build() changes
+# what it writes, so a stale cached build is not reused
+DEFAULT_DIR = os.path.join(tempfile.gettempdir(), "llm-guard-tiny-model-2")
+
+# Vocabulary of the generated tokenizer; load_test.py builds its prompts from it
+WORDS = (
+    "the a an and or but if then so because while when where what which who how why is are was were be been "
+    "i you he she it we they me him her us them my your our their this that these those here there "
+    "can could would should will shall may might must do does did done have has had make made get got "
+    "tell explain write show give find help build create describe compare list summarize translate "
+    "story poem email report code function script query table plan recipe letter essay answer question "
+    "weather today tomorrow yesterday morning evening week month year time day night "
+    "cat cats dog dogs bird city country river mountain ocean forest garden house car train plane "
+    "python java rust database server network cache request response error bug test deploy release "
+    "money bank price market stock tax budget invoice payment account password login user admin "
+    "doctor medicine health symptom treatment law court contract policy privacy secret data file "
+    "weapon bomb drug attack hack exploit malware virus threat violence "
+    "please thanks hello hi ok yes no sure again more less very really quite about with without "
+    "for from into onto over under between after before during of on in at by to up down out off"
+).split()
+
+SPECIAL_TOKENS = ("<unk>", "<|im_start|>", "<|im_end|>", "<pad>")
+CHAT_TEMPLATE = (
+    "{% for m in messages %}<|im_start|>{{ m['role'] }}\n{{ m['content'] }}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+# Qwen2 pre-tokenizer split; transformers 5 rebuilds any qwen2 checkpoint's tokenizer with it
+PRETOKENIZE_REGEX = (
+    r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+
+
+def _word_level_tokenizer():
+    from tokenizers import Regex, Tokenizer, decoders, models, normalizers, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast
+
+    # Byte-level BPE laid out like Qwen2Tokenizer, so both the fast tokenizer (transformers 4)
+    # and Qwen2Tokenizer (transformers 5) reload it the same way. Merges are trained until every
+    # word, with and without a leading space, is a single token.
+    backend = Tokenizer(models.BPE())
+    backend.normalizer = normalizers.NFC()
+    backend.pre_tokenizer = pre_tokenizers.Sequence([
+        pre_tokenizers.Split(Regex(PRETOKENIZE_REGEX), behavior="isolated", invert=False),
+        pre_tokenizers.ByteLevel(add_prefix_space=False, use_regex=False),
+    ])
+    backend.decoder = decoders.ByteLevel()
+    words = list(RISK_CODES) + ["system", "user", "assistant"] + list(WORDS)
+    trainer = trainers.BpeTrainer(
+        vocab_size=1_000_000, min_frequency=1, show_progress=False,
+        special_tokens=list(SPECIAL_TOKENS), initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    )
+    backend.train_from_iterator([text for word in words for text in (word, " " + word)], trainer)
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend, unk_token="<unk>", pad_token="<pad>",
+        eos_token="<|im_end|>", bos_token="<|im_start|>",
+    )
+    tokenizer.chat_template = CHAT_TEMPLATE
+    return tokenizer, {code: code for code in RISK_CODES}
+
+
+def build(out_dir: str, tokenizer_path: str = None, layers: int = 2, hidden: int = 64, seed: int = 0) -> str:
+    import torch
+    from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer, Qwen2Config
+
+    if tokenizer_path:
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+        id2risk = tokenizer.init_kwargs.get("id2risk", {})
+        config = AutoConfig.from_pretrained(tokenizer_path)
+    else:
+        tokenizer, id2risk = _word_level_tokenizer()
+        config = Qwen2Config(
+            bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id,
+            pad_token_id=tokenizer.pad_token_id, max_position_embeddings=32768,
+        )
+    heads = max(1, hidden // 16)
+    config.vocab_size = len(tokenizer)
+    config.hidden_size = hidden
+    config.intermediate_size = hidden * 2
+    config.num_hidden_layers = layers
+    config.num_attention_heads = heads
+    config.num_key_value_heads = max(1, heads // 2)
+    config.head_dim = hidden // heads
+    if hasattr(config, "layer_types"):
+        config.layer_types = config.layer_types[:layers]
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer.save_pretrained(out_dir)
+    # save_pretrained drops unknown init kwargs; SafetyEngine reads id2risk from here
+    config_path = os.path.join(out_dir, "tokenizer_config.json")
+    with open(config_path) as f:
+        tokenizer_config = json.load(f)
+    tokenizer_config["id2risk"] = id2risk
+    if not tokenizer_path:
+        # save_pretrained writes "TokenizersBackend", which transformers 4 cannot resolve
+        tokenizer_config["tokenizer_class"] = "PreTrainedTokenizerFast"
+    with open(config_path, "w") as f:
+        json.dump(tokenizer_config, f, ensure_ascii=False, indent=2)
+
+    torch.manual_seed(seed)
+    model = AutoModelForCausalLM.from_config(config)
+    # Push risk tokens up the ranking so SCORING_MODE=generate (top-k) also finds them
+    decoded = tokenizer.batch_decode([[token_id] for token_id in range(len(tokenizer))])
+    risk_ids = [token_id for token_id, text in enumerate(decoded) if text.strip() in id2risk]
+    with torch.no_grad():
+        model.get_output_embeddings().weight[risk_ids] *= 8
+    model.save_pretrained(out_dir)
+
+    if not tokenizer_path:
+        reloaded = AutoTokenizer.from_pretrained(out_dir)
+        sample = list(WORDS[:32])
+        ids = reloaded(" ".join(sample), add_special_tokens=False)["input_ids"]
+        assert len(ids) == len(sample), f"reloaded tokenizer gives {len(ids)} ids for {len(sample)} words"
+    return out_dir
+
+
+def ensure(out_dir: str = DEFAULT_DIR) -> str:
+    """Builds the default tiny model into out_dir unless a build is already there."""
+    if not os.path.exists(os.path.join(out_dir, "config.json")):
+        print(f"Building tiny guard model in {out_dir}")
+        build(out_dir)
+    return out_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir")
+    parser.add_argument("--tokenizer", help="reuse the tokenizer and architecture of this checkpoint")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--hidden", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    build(args.out_dir, args.tokenizer, args.layers, args.hidden, args.seed)
+    print(f"Tiny guard model written to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
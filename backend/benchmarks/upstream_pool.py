@@ -0,0 +1,85 @@
+"""
+Drives UpstreamPool against local mock upstreams.
+
+Starts one healthy mock backend and one that always fails, sends a burst of
+blocking and streaming requests through the pool and prints per-backend stats,
+so balancing, retries and ejection can be checked without a real LLM.
+
+    cd backend
+    python benchmarks/upstream_pool.py [--requests 200] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn  # noqa: E402
+
+from benchmarks.mock_upstream import create_app  # noqa: E402
+from upstream import UpstreamBackend, UpstreamPool  # noqa: E402
+
+
+async def serve(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def run(args):
+    healthy_a, task_a = await serve(create_app(latency_ms=args.latency_ms, tokens=32), args.port)
+    healthy_b, task_b = await serve(create_app(latency_ms=args.latency_ms * 2, tokens=32), args.port + 1)
+    broken, task_c = await serve(create_app(fail_rate=1.0), args.port + 2)
+
+    pool = UpstreamPool([
+        UpstreamBackend(f"http://127.0.0.1:{args.port}/v1", "sk-mock"),
+        UpstreamBackend(f"http://127.0.0.1:{args.port + 1}/v1", "sk-mock"),
+        UpstreamBackend(f"http://127.0.0.1:{args.port + 2}/v1", "sk-mock"),
+    ])
+    await pool.start()
+    payload = {"model": "mock", "messages": [{"role": "user", "content": "hi"}]}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    failures = 0
+
+    async def one(i):
+        nonlocal failures
+        async with semaphore:
+            try:
+                if i % 2:
+                    async with pool.stream({**payload, "stream": True}) as response:
+                        async for _ in response.aiter_lines():
+                            pass
+                else:
+                    await pool.post_json(payload)
+            except Exception:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(args.requests)])
+    elapsed = time.perf_counter() - started
+    await pool.close()
+
+    print(f"{args.requests} requests in {elapsed:.2f}s ({args.requests / elapsed:.1f} req/s), {failures} failed")
+    for backend in pool.stats()["backends"]:
+        print(backend)
+
+    for server in (healthy_a, healthy_b, broken):
+        server.should_exit = True
+    await asyncio.gather(task_a, task_b, task_c)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--port", type=int, default=9100)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
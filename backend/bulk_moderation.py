@@ -0,0 +1,252 @@
+"""
+Bulk offline moderation.
+
+Reads JSONL conversations as a stream, scores them in large batches and streams
+JSONL verdicts back in input order, judged against the current SecurityPolicy
+thresholds. Only a few batches are held in memory at a time.
+
+Input, one JSON object per line:
+    {"id": "conv-1", "messages": [{"role": "user", "content": "..."}, ...]}
+    {"id": "doc-7", "input": "plain text"}
+A conversation ending with an assistant message is checked as a response
+(override with "check_response"). Blank lines are skipped but still count
+toward offsets.
+
+Output lines have a "type": "result" per record, "progress" every
+BULK_PROGRESS_EVERY records, and a final "summary". Every result carries the
+record's 0-based line offset; rerun with offset = last offset + 1 to resume.
+
+    POST /v1/moderations?offset=0      (request body: JSONL)
+
+    cd backend
+    python bulk_moderation.py conversations.jsonl -o verdicts.jsonl [--offset N | --resume]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+
+from batcher import batcher, GuardOverloaded, GuardUnavailable
+from config import settings
+from inference_client import inference_client
+from model_loader import model_loader
+from policy_store import policy_store
+
+router = APIRouter()
+
+
+def parse_record(offset: int, line: str):
+    # Returns (offset, record id, messages, check_response) or (offset, record id, error)
+    record = None
+    try:
+        record = json.loads(line)
+        messages = record.get("messages")
+        if messages is None:
+            messages = [{"role": "user", "content": str(record["input"])}]
+        messages = [{"role": m["role"], "content": m.get("content") or ""} for m in messages]
+        if not messages:
+            raise ValueError("empty conversation")
+        check_response = record.get("check_response", messages[-1]["role"] == "assistant")
+        return offset, record.get("id"), messages, bool(check_response)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        record_id = record.get("id") if isinstance(record, dict) else None
+        return offset, record_id, f"invalid record: {e}"
+
+
+async def score_conversations(conversations) -> list:
+    # Offline jobs wait out overload instead of failing; they never fail open
+    while True:
+        try:
+            if settings.INFERENCE_SERVER_SOCKET:
+                return await inference_client.infer_many(conversations, settings.BULK_BATCH_SIZE)
+            return await batcher.infer_many(conversations, settings.BULK_BATCH_SIZE)
+        except GuardOverloaded as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def score_batch(batch) -> list:
+    valid = [item for item in batch if len(item) == 4]
+    try:
+        risk_maps = await score_conversations([(messages, check) for _, _, messages, check in valid])
+    except Exception as e:
+        error = f"scoring failed: {e}"
+        return [{"type": "result", "offset": item[0], "id": item[1], "error": error} for item in batch]
+
+    snapshot = policy_store.current
+    verdicts = iter(zip(valid, risk_maps))
+    results = []
+    for item in batch:
+        if len(item) == 3:
+            results.append({"type": "result", "offset": item[0], "id": item[1], "error": item[2]})
+            continue
+        (offset, record_id, _, check_response), risk_map = next(verdicts)
+        is_safe, category, reason = snapshot.check(risk_map)
+        results.append({
+            "type": "result",
+            "offset": offset,
+            "id": record_id,
+            "direction": "response" if check_response else "prompt",
+            "flagged": not is_safe,
+            "category": category,
+            "reason": reason,
+            "policy_version": snapshot.version,
+            "scores": risk_map,
+        })
+    return results
+
+
+async def moderate_lines(lines, start_offset: int = 0):
+    """Async iterator of output records for an async iterator of input lines."""
+    started = time.perf_counter()
+    totals = {"records": 0, "flagged": 0, "errors": 0}
+    in_flight = deque()
+    batch = []
+    offset = -1
+    last_offset = start_offset - 1
+
+    def progress(kind):
+        elapsed = time.perf_counter() - started
+        return {
+            "type": kind,
+            "start_offset": start_offset,
+            "last_offset": last_offset,
+            **totals,
+            "elapsed_s": round(elapsed, 3),
+            "records_per_s": round(totals["records"] / elapsed, 1) if elapsed else 0.0,
+        }
+
+    async def drain(limit):
+        nonlocal last_offset
+        while len(in_flight) > limit:
+            for result in await in_flight.popleft():
+                totals["records"] += 1
+                if "error" in result:
+                    totals["errors"] += 1
+                elif result["flagged"]:
+                    totals["flagged"] += 1
+                last_offset = result["offset"]
+                yield result
+                if settings.BULK_PROGRESS_EVERY and totals["records"] % settings.BULK_PROGRESS_EVERY == 0:
+                    yield progress("progress")
+
+    try:
+        async for line in lines:
+            offset += 1
+            if offset < start_offset or not line.strip():
+                continue
+            batch.append(parse_record(offset, line))
+            if len(batch) >= settings.BULK_BATCH_SIZE:
+                in_flight.append(asyncio.create_task(score_batch(batch)))
+                batch = []
+                # Keep a few batches queued so the model never idles, but no more
+                async for result in drain(settings.BULK_MAX_BATCHES_IN_FLIGHT):
+                    yield result
+        if batch:
+            in_flight.append(asyncio.create_task(score_batch(batch)))
+        async for result in drain(0):
+            yield result
+        yield progress("summary")
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+
+async def body_lines(request: Request):
+    # Splits the streamed request body into lines without buffering all of it
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *complete, buffer = buffer.split(b"\n")
+        for line in complete:
+            yield line.decode("utf-8", errors="replace")
+    if buffer:
+        yield buffer.decode("utf-8", errors="replace")
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that keeps reading the request body while it streams.
+    The stock disconnect listener consumes receive() messages, which would swallow
+    body chunks; a disconnect still surfaces through request.stream() instead.
+    """
+
+    async def listen_for_disconnect(self, receive):
+        await asyncio.Event().wait()
+
+
+@router.post("/v1/moderations")
+async def moderations(request: Request, offset: int = 0):
+    if not model_loader.ready:
+        raise GuardUnavailable("Guard model is still loading", retry_after=5)
+
+    async def stream():
+        async for record in moderate_lines(body_lines(request), offset):
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+
+    return BodyStreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+async def file_lines(path):
+    with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as f:
+        for line in f:
+            yield line
+
+
+def resume_offset(path) -> int:
+    # One past the highest offset already written to an earlier output file
+    last = -1
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("type") == "result":
+                    last = max(last, record["offset"])
+    return last + 1
+
+
+async def run_cli(args):
+    from sqlmodel import Session
+    from database import create_db_and_tables, engine
+    from main import ensure_default_policies
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        ensure_default_policies(session)
+        policy_store.load(session)
+    model_loader.start()
+    await model_loader._task
+    if not model_loader.ready:
+        sys.exit(f"guard model failed to load: {model_loader.error}")
+
+    offset = resume_offset(args.output) if args.resume and args.output else args.offset
+    out = open(args.output, "a" if args.resume else "w", encoding="utf-8") if args.output else sys.stdout
+    print(f"Moderating {args.input} from offset {offset}", file=sys.stderr)
+    try:
+        async for record in moderate_lines(file_lines(args.input), offset):
+            if record["type"] == "result":
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            else:
+                print(json.dumps(record), file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        await batcher.stop()
+        await inference_client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk guard moderation of a JSONL file")
+    parser.add_argument("input", help="JSONL file of conversations ('-' for stdin)")
+    parser.add_argument("-o", "--output", help="JSONL verdicts (default: stdout)")
+    parser.add_argument("--offset", type=int, default=0, help="first input line to score")
+    parser.add_argument("--resume", action="store_true", help="continue after the last offset in --output")
+    asyncio.run(run_cli(parser.parse_args()))
@@ -1,14 +1,128 @@
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     # Model Configuration
     MODEL_PATH: str = "./YuFeng-XGuard-Reason-0.6B"
+    # "auto" / "cuda" / "cpu" load the model as-is; "cpu-int8" is a dynamically int8-quantized CPU backend
     DEVICE: str = "auto"
+    # "forward": one forward pass, risk tokens gathered from the last-position logits
+    # "generate": reference path via model.generate + top-k decoding
+    SCORING_MODE: str = "forward"
+    # CPU thread pools used by torch (0 keeps torch's default); matters most for DEVICE=cpu / cpu-int8
+    CPU_THREADS: int = 0
+    CPU_INTEROP_THREADS: int = 0
+
+    # KV Prefix Reuse (forward scoring only; 0 disables)
+    PREFIX_CACHE_MAX_MB: float = 256.0
+    PREFIX_CACHE_MIN_TOKENS: int = 32
+
+    # Guard context budget: longer conversations keep the system prompt and the most
+    # recent turns; an oversized last message or system prompt is scored as overlapping windows (0 disables)
+    GUARD_MAX_TOKENS: int = 4096
+    GUARD_WINDOW_OVERLAP_TOKENS: int = 256
+    GUARD_TOKEN_COUNT_CACHE_SIZE: int = 8192
+
+    # Pre-filter tier ahead of the guard model (hash/phrase lists managed via /api/filters).
+    # Prompts sent without a system prompt or earlier turns, shorter than PREFILTER_MIN_CHARS, or without any letters when
+    # PREFILTER_ALLOW_NO_LETTERS is set, are allowed without a model call (0 / False disable).
+    PREFILTER_ENABLED: bool = True
+    PREFILTER_MIN_CHARS: int = 0
+    PREFILTER_ALLOW_NO_LETTERS: bool = False
+
+    # Warmup passes run after loading, at roughly these token lengths ([] disables)
+    WARMUP_SEQ_LENS: List[int] = [64, 512]
+
+    # Guard Inference Batching
+    BATCH_MAX_SIZE: int = 8
+    BATCH_MAX_WAIT_MS: float = 5.0
+
+    # Shared inference server (see inference_server.py). When set, workers send checks
+    # over this Unix socket instead of loading the model themselves.
+    INFERENCE_SERVER_SOCKET: str = ""
+    INFERENCE_CLIENT_CONNECTIONS: int = 2
+
+    # Guard Admission Control
+    # Checks queued or running at once before new ones are rejected (0 = unbounded)
+    GUARD_MAX_PENDING: int = 256
+    # HTTP status returned when a check is rejected or times out fail-closed (429 or 503)
+    GUARD_OVERLOAD_STATUS: int = 503
+    # Per-direction timeout (0 disables) and what to do when it fires: "open" (allow) or "closed" (reject)
+    GUARD_PROMPT_TIMEOUT_S: float = 10.0
+    GUARD_RESPONSE_TIMEOUT_S: float = 10.0
+    GUARD_PROMPT_FAIL_MODE: str = "closed"
+    GUARD_RESPONSE_FAIL_MODE: str = "closed"
+    # Event-loop lag sampling interval
+    LOOP_LAG_INTERVAL_MS: float = 100.0
+
+    # How often each worker checks the policy version counter (0 disables the check)
+    POLICY_SYNC_INTERVAL_S: float = 1.0
+
+    # Bulk moderation (/v1/moderations and bulk_moderation.py): records per model batch,
+    # batches queued ahead of the one being streamed back, and progress line interval
+    BULK_BATCH_SIZE: int = 32
+    BULK_MAX_BATCHES_IN_FLIGHT: int = 4
+    BULK_PROGRESS_EVERY: int = 1000
+
+    # Verdict Cache (raw risk maps; 0 disables)
+    VERDICT_CACHE_SIZE: int = 4096
+    VERDICT_CACHE_TTL_S: float = 300.0
 
     # Upstream LLM Configuration (For Proxy)
     UPSTREAM_API_BASE: str = "https://api.openai.com/v1"
     UPSTREAM_API_KEY: str = "sk-placeholder"
     UPSTREAM_MODEL: str = "gpt-3.5-turbo"
+    # Optional list of backends, JSON: [{"api_base": "...", "api_key": "...", "model": "..."}]
+    # When empty, UPSTREAM_API_BASE / UPSTREAM_API_KEY is the only backend.
+    UPSTREAM_BACKENDS: List[Dict[str, str]] = []
+
+    # Upstream Connection Pool
+    UPSTREAM_HTTP2: bool = True
+    UPSTREAM_MAX_CONNECTIONS: int = 100
+    UPSTREAM_MAX_KEEPALIVE: int = 20
+    UPSTREAM_KEEPALIVE_EXPIRY_S: float = 30.0
+    UPSTREAM_TIMEOUT_S: float = 60.0
+    UPSTREAM_RETRIES: int = 2
+    UPSTREAM_RETRY_BACKOFF_MS: float = 100.0
+    # Consecutive failures before a backend is taken out of rotation, and for how long
+    UPSTREAM_EJECT_AFTER_FAILURES: int = 3
+    UPSTREAM_EJECT_SECONDS: float = 30.0
+    # Start the upstream call in parallel with the prompt check (cancelled if the prompt is blocked)
+    SPECULATIVE_UPSTREAM: bool = False
+
+    # Audit Log Writer
+    AUDIT_QUEUE_SIZE: int = 10000
+    AUDIT_BATCH_SIZE: int = 500
+    AUDIT_FLUSH_INTERVAL_MS: float = 200.0
+    # What to do when the queue is full: "block" (back-pressure), "drop_newest" or "drop_oldest"
+    AUDIT_OVERFLOW: str = "block"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    # Per-minute stats rollups are kept this long; hourly and all-time rollups are kept forever
+    STATS_MINUTE_RETENTION_HOURS: int = 48
+    # Audit rows older than this many days are moved to gzip JSONL archives (0 keeps them forever)
+    AUDIT_RETENTION_DAYS: int = 0
+    AUDIT_ARCHIVE_DIR: str = "archive"
+    AUDIT_RETENTION_INTERVAL_S: float = 3600.0
+    # Rows archived per transaction, and the pause between transactions so the writer is never locked out for long
+    AUDIT_ARCHIVE_BATCH_SIZE: int = 1000
+    AUDIT_ARCHIVE_PAUSE_MS: float = 50.0
+
+    # Observability
+    # Per-stage histograms served at /metrics
+    METRICS_ENABLED: bool = True
+    # Also store each request's per-stage breakdown (JSON, ms) on its audit row
+    AUDIT_STAGE_TIMINGS: bool = False
+    # Sampling profiler (started from the admin API): default interval and longest run
+    PROFILER_INTERVAL_MS: float = 10.0
+    PROFILER_MAX_DURATION_S: float = 300.0
+
+    # Streaming Moderation
+    STREAM_MODERATION: bool = True
+    # Re-score the accumulated reply every N characters
+    STREAM_CHECK_INTERVAL_CHARS: int = 200
+    # How far (in characters) the client lags behind the upstream stream; text is
+    # also never relayed before it has been scored
+    STREAM_HOLDBACK_CHARS: int = 200
 
     class Config:
         env_file = ".env"
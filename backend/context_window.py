@@ -0,0 +1,158 @@
+import hashlib
+from collections import OrderedDict
+
+
+class ContextPolicy:
+    """
+    Keeps guard inputs within a token budget.
+    Long conversations keep the system prompt plus the most recent turns that
+    fit; a final message that is too long on its own is split into overlapping
+    windows, each scored separately (the caller takes the per-category max).
+    A system prompt over half the budget is windowed the same way: its tail
+    stays in front of the kept turns and every earlier window is scored with
+    those same turns, so no part of it goes unchecked.
+    When the final message is a reply, the user turn it answers keeps at least
+    its tail, so a response is never judged without the question.
+    Per-message token counts are cached, so replayed history is not re-tokenized.
+    """
+
+    def __init__(self, tokenizer, render, max_tokens: int, overlap_tokens: int, count_cache_size: int):
+        # plan() runs on the batcher's model thread, next to the engine's own tokenizer calls
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = max(0, overlap_tokens)
+        self.count_cache_size = count_cache_size
+        self._counts = OrderedDict()
+        self.count_hits = 0
+        self.count_misses = 0
+        self.truncated = 0
+        self.windowed = 0
+        # Template tokens around one message (role markers, generation prompt)
+        self.message_overhead = len(tokenizer(render([{"role": "user", "content": ""}]))["input_ids"])
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_tokens > 0
+
+    def count(self, text: str) -> int:
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        count = self._counts.get(key)
+        if count is not None:
+            self.count_hits += 1
+            self._counts.move_to_end(key)
+            return count
+        self.count_misses += 1
+        count = len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+        if self.count_cache_size > 0:
+            self._counts[key] = count
+            if len(self._counts) > self.count_cache_size:
+                self._counts.popitem(last=False)
+        return count
+
+    def plan(self, messages):
+        """
+        Returns (conversations, decision). conversations is [messages] when the
+        input already fits; decision is None then, otherwise a dict describing
+        what was dropped or windowed, for the audit log.
+        """
+        if not self.enabled or not messages:
+            return [messages], None
+        sizes = [self.count(m.get("content") or "") + self.message_overhead for m in messages]
+        total = sum(sizes)
+        if total <= self.max_tokens:
+            return [messages], None
+
+        # Leading system messages are kept whole unless they would take over the budget;
+        # then they keep their last window here and the earlier ones are scored separately
+        n_system = 0
+        while n_system < len(messages) - 1 and messages[n_system].get("role") == "system":
+            n_system += 1
+        system, system_size = messages[:n_system], sum(sizes[:n_system])
+        system_windows = []
+        if system_size > self.max_tokens // 2:
+            text = "\n".join(m.get("content") or "" for m in system)
+            ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+            system_windows = self._windows(ids, max(1, self.max_tokens // 2 - self.message_overhead))
+            tail = system_windows.pop()
+            system = [{"role": "system", "content": tail}]
+            system_size = self.count(tail) + self.message_overhead
+        budget = self.max_tokens - system_size
+
+        # When a reply is checked, the user turn it answers is never dropped entirely: if it does
+        # not fit it keeps its tail, up to a quarter of the budget or whatever the reply leaves
+        anchor = None
+        if messages[-1].get("role") != "user":
+            anchor = next((i for i in range(len(messages) - 2, n_system - 1, -1)
+                           if messages[i].get("role") == "user"), None)
+        start = self._recent(sizes, n_system, budget)
+        anchor_msgs, anchor_size = [], 0
+        if anchor is not None and start > anchor:
+            anchor_size = min(sizes[anchor], max(budget // 4, budget - sizes[-1]))
+            tail_tokens = anchor_size - self.message_overhead
+            if tail_tokens > 0:
+                ids = self.tokenizer(messages[anchor].get("content") or "", add_special_tokens=False)["input_ids"]
+                anchor_msgs = [{**messages[anchor], "content": self.tokenizer.decode(ids[-tail_tokens:])}]
+                budget -= anchor_size
+                start = self._recent(sizes, max(n_system, anchor + 1), budget)
+            else:
+                anchor_size = 0
+        head = system + anchor_msgs
+
+        decision = {
+            "input_tokens": total,
+            "max_tokens": self.max_tokens,
+            "kept_messages": len(head) + len(messages) - start,
+            "dropped_messages": start - n_system - len(anchor_msgs),
+        }
+        if system_windows:
+            decision["system_windows"] = len(system_windows) + 1
+        if anchor_msgs:
+            decision["user_turn_tokens"] = anchor_size - self.message_overhead
+
+        last = messages[-1]
+        if sizes[-1] <= budget:
+            self.truncated += 1
+            return self._with_system_windows([head + messages[start:]], system_windows), decision
+
+        # The final message alone is over budget: overlapping windows of it
+        ids = self.tokenizer(last.get("content") or "", add_special_tokens=False)["input_ids"]
+        window = max(1, budget - self.message_overhead)
+        conversations = [head + [{**last, "content": text}] for text in self._windows(ids, window)]
+        self.windowed += 1
+        decision.update({"kept_messages": len(head) + 1,
+                         "dropped_messages": len(messages) - n_system - len(anchor_msgs) - 1,
+                         "windows": len(conversations), "window_tokens": window,
+                         "overlap_tokens": min(self.overlap_tokens, window // 2)})
+        return self._with_system_windows(conversations, system_windows), decision
+
+    def _windows(self, ids, window: int) -> list:
+        # Overlapping windows of at most `window` tokens, decoded back to text
+        overlap = min(self.overlap_tokens, window // 2)
+        return [self.tokenizer.decode(ids[offset:offset + window])
+                for offset in range(0, max(1, len(ids) - overlap), window - overlap)]
+
+    @staticmethod
+    def _with_system_windows(conversations, system_windows):
+        # Earlier system prompt windows stand in for its tail in front of the first conversation's turns
+        return conversations + [[{"role": "system", "content": text}] + conversations[0][1:] for text in system_windows]
+
+    def _recent(self, sizes, first: int, budget: int) -> int:
+        # Most recent turns, newest first, while they fit; the last message is always checked
+        start = len(sizes) - 1
+        used = sizes[start]
+        while start - 1 >= first and used + sizes[start - 1] <= budget:
+            start -= 1
+            used += sizes[start]
+        return start
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "max_tokens": self.max_tokens,
+            "overlap_tokens": self.overlap_tokens,
+            "truncated": self.truncated,
+            "windowed": self.windowed,
+            "count_cache_entries": len(self._counts),
+            "count_cache_hits": self.count_hits,
+            "count_cache_misses": self.count_misses,
+        }
@@ -1,14 +1,53 @@
+from sqlalchemy import event, inspect, text
 from sqlmodel import SQLModel, create_engine
-from sqlmodel.pool import StaticPool
+
+from config import settings
 
 sqlite_file_name = "gateway.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
-engine = create_engine(
-    sqlite_url, 
-    connect_args={"check_same_thread": False}, 
-    poolclass=StaticPool
-)
+def make_engine(url: str):
+    db_engine = create_engine(
+        url, 
+        connect_args={"check_same_thread": False}
+    )
+
+    @event.listens_for(db_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers (admin API) run while the audit writer commits,
+        # and NORMAL sync avoids an fsync per transaction.
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-20000")
+        cursor.close()
+
+    return db_engine
+
+engine = make_engine(sqlite_url)
+
+def add_missing_columns(db_engine):
+    # create_all() never alters existing tables; add columns (and their indexes) introduced
+    # since the database was created. New columns must be nullable (or have a server default).
+    inspector = inspect(db_engine)
+    with db_engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=db_engine.dialect)
+                    conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                    print(f"Added column {table.name}.{column.name}")
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    print(f"Added index {index.name}")
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    add_missing_columns(engine)
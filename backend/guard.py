@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+from batcher import batcher, GuardUnavailable
+from config import settings
+from inference_client import inference_client
+from model_loader import model_loader
+from verdict_cache import verdict_cache
+
+# Checks that ran out of time or were turned away, per direction, and how they were resolved
+guard_stats = {
+    "prompt_timeouts": 0,
+    "response_timeouts": 0,
+    "prompt_failed_open": 0,
+    "response_failed_open": 0,
+    "prompt_failed_closed": 0,
+    "response_failed_closed": 0,
+}
+
+
+async def _score(messages, check_response, cached):
+    # Context windowing and rendering happen next to the model (here or in the
+    # shared server), so the cache keys on the conversation itself
+    if settings.INFERENCE_SERVER_SOCKET:
+        compute = lambda: inference_client.infer(messages, check_response)
+    else:
+        compute = lambda: batcher.infer(messages, check_response)
+    if not cached:
+        return await compute()
+    text = json.dumps(messages, sort_keys=True, ensure_ascii=False)
+    key = verdict_cache.key(text, "response" if check_response else "prompt")
+    return await verdict_cache.get_or_compute(key, compute)
+
+
+async def score_messages(messages, check_response=False, cached=True) -> dict:
+    """
+    Returns the raw risk map for a conversation.
+    Repeated conversations are answered from the verdict cache; everything else is
+    scored through the micro-batcher. Policy thresholds are NOT applied here.
+    Pass cached=False for one-off checks (e.g. partial streamed replies).
+
+    Raises GuardUnavailable regardless of fail mode until the model is ready.
+    If the guard is overloaded or does not answer within the direction's timeout,
+    fail-open returns an empty risk map (nothing blocks) and fail-closed raises
+    GuardUnavailable.
+    """
+    if not model_loader.ready:
+        # Not a guard failure: nothing may pass unchecked before the model is up
+        raise GuardUnavailable("Guard model is still loading", retry_after=5)
+    direction = "response" if check_response else "prompt"
+    if check_response:
+        timeout, fail_mode = settings.GUARD_RESPONSE_TIMEOUT_S, settings.GUARD_RESPONSE_FAIL_MODE
+    else:
+        timeout, fail_mode = settings.GUARD_PROMPT_TIMEOUT_S, settings.GUARD_PROMPT_FAIL_MODE
+
+    try:
+        return await asyncio.wait_for(_score(messages, check_response, cached), timeout or None)
+    except asyncio.TimeoutError:
+        guard_stats[f"{direction}_timeouts"] += 1
+        error = GuardUnavailable(f"Guard {direction} check timed out after {timeout}s")
+    except GuardUnavailable as e:
+        error = e
+
+    if fail_mode == "open":
+        guard_stats[f"{direction}_failed_open"] += 1
+        print(f"WARNING: {error}; failing open")
+        return {}
+    guard_stats[f"{direction}_failed_closed"] += 1
+    raise error
@@ -0,0 +1,143 @@
+import asyncio
+import itertools
+import json
+import struct
+
+from batcher import GuardOverloaded, GuardUnavailable
+from config import settings
+
+# Frames on the inference socket: 4-byte big-endian length, then a UTF-8 JSON object.
+# Every request carries an "id" that the matching response echoes, so many requests
+# can be in flight on one connection and answered out of order.
+_HEADER = struct.Struct(">I")
+
+
+async def read_frame(reader: asyncio.StreamReader) -> dict:
+    header = await reader.readexactly(_HEADER.size)
+    (length,) = _HEADER.unpack(header)
+    return json.loads(await reader.readexactly(length))
+
+
+def encode_frame(message: dict) -> bytes:
+    body = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    return _HEADER.pack(len(body)) + body
+
+
+class _Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.waiters = {}
+        self.reader_task = asyncio.create_task(self._read_loop())
+
+    @property
+    def alive(self) -> bool:
+        return not self.reader_task.done()
+
+    async def _read_loop(self):
+        error = GuardUnavailable("Inference server connection closed")
+        try:
+            while True:
+                message = await read_frame(self.reader)
+                future = self.waiters.pop(message.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            error = GuardUnavailable(f"Inference server connection lost: {e}")
+        except Exception as e:
+            # A malformed frame leaves the stream out of sync, so the connection is dropped
+            error = GuardUnavailable(f"Inference server sent a bad frame: {e!r}")
+            print(f"ERROR: {error}")
+        finally:
+            # However the loop ended, nobody waiting on this connection may hang
+            self.writer.close()
+            for future in self.waiters.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.waiters.clear()
+
+    async def request(self, request_id: int, message: dict) -> dict:
+        if not self.alive:
+            raise GuardUnavailable("Inference server connection closed")
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[request_id] = future
+        try:
+            self.writer.write(encode_frame({"id": request_id, **message}))
+            await self.writer.drain()
+            return await future
+        finally:
+            self.waiters.pop(request_id, None)
+
+    async def close(self):
+        self.reader_task.cancel()
+        self.writer.close()
+
+
+class InferenceClient:
+    """
+    Talks to inference_server.py over a Unix socket.
+    infer() has the same shape as InferenceBatcher.infer, so gateway workers can
+    use the shared server in place of a local model. A few long-lived connections
+    are reused and requests are pipelined on them.
+    """
+
+    def __init__(self, socket_path: str, connections: int = 2):
+        self.socket_path = socket_path
+        self.size = max(1, connections)
+        self._connections = []
+        self._next = itertools.cycle(range(self.size))
+        self._ids = itertools.count(1)
+        self._connect_lock = None
+        self.categories = None
+
+    async def _connection(self) -> _Connection:
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        slot = next(self._next)
+        async with self._connect_lock:
+            while len(self._connections) <= slot:
+                self._connections.append(None)
+            conn = self._connections[slot]
+            if conn is None or not conn.alive:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(self.socket_path)
+                except OSError as e:
+                    raise GuardUnavailable(f"Inference server unreachable at {self.socket_path}: {e}")
+                conn = self._connections[slot] = _Connection(reader, writer)
+        return conn
+
+    async def call(self, op: str, **payload) -> dict:
+        conn = await self._connection()
+        response = await conn.request(next(self._ids), {"op": op, **payload})
+        if "error" in response:
+            error_cls = GuardOverloaded if response.get("overloaded") else GuardUnavailable
+            raise error_cls(response["error"], response.get("retry_after", 1))
+        return response
+
+    async def connect(self):
+        # Handshake: learn the server's category order for the policy snapshot
+        info = await self.call("info")
+        self.categories = info["categories"]
+        return info
+
+    async def infer(self, messages, check_response=False) -> dict:
+        response = await self.call("score", messages=messages, check_response=check_response)
+        return response["risk_map"]
+
+    async def infer_many(self, conversations, batch_size: int = 0) -> list:
+        response = await self.call(
+            "score_many", conversations=[[m, c] for m, c in conversations], batch_size=batch_size
+        )
+        return response["risk_maps"]
+
+    async def stats(self) -> dict:
+        return (await self.call("stats"))["stats"]
+
+    async def close(self):
+        for conn in self._connections:
+            if conn is not None:
+                await conn.close()
+        self._connections = []
+
+
+inference_client = InferenceClient(settings.INFERENCE_SERVER_SOCKET, settings.INFERENCE_CLIENT_CONNECTIONS)
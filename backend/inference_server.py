@@ -0,0 +1,107 @@
+"""
+Shared guard inference server.
+
+One process owns the model and batches checks from every gateway worker, so
+running uvicorn with several workers no longer loads one model copy per worker.
+
+    cd backend
+    python inference_server.py                       # listens on INFERENCE_SERVER_SOCKET
+    INFERENCE_SERVER_SOCKET=/tmp/llm-guard.sock uvicorn main:app --workers 4
+"""
+import asyncio
+import os
+import signal
+
+from batcher import InferenceBatcher, GuardOverloaded, GuardUnavailable
+from config import settings
+from inference_client import encode_frame, read_frame
+from model_loader import load_engine
+
+batcher = InferenceBatcher(None, settings.BATCH_MAX_SIZE, settings.BATCH_MAX_WAIT_MS, settings.GUARD_MAX_PENDING)
+
+
+def _unavailable(e: GuardUnavailable) -> dict:
+    # The client raises GuardOverloaded only for a full queue, GuardUnavailable otherwise
+    return {"error": str(e), "retry_after": e.retry_after, "overloaded": isinstance(e, GuardOverloaded)}
+
+
+async def handle_request(message: dict) -> dict:
+    op = message.get("op")
+    if op == "score":
+        try:
+            risk_map = await batcher.infer(message["messages"], message.get("check_response", False))
+        except GuardUnavailable as e:
+            return _unavailable(e)
+        return {"risk_map": risk_map}
+    if op == "score_many":
+        try:
+            conversations = [(m, c) for m, c in message["conversations"]]
+            risk_maps = await batcher.infer_many(conversations, message.get("batch_size", 0))
+        except GuardUnavailable as e:
+            return _unavailable(e)
+        return {"risk_maps": risk_maps}
+    if op == "info":
+        return {"categories": batcher.engine.categories}
+    if op == "stats":
+        stats = batcher.stats()
+        stats["prefix_cache"] = batcher.engine.prefix_cache.stats()
+        stats["context"] = batcher.engine.context.stats()
+        return {"stats": stats}
+    return {"error": f"Unknown op {op!r}"}
+
+
+async def serve_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    write_lock = asyncio.Lock()
+    tasks = set()
+
+    async def answer(message):
+        try:
+            response = await handle_request(message)
+        except Exception as e:
+            print(f"ERROR: Inference request failed: {e}")
+            response = {"error": str(e)}
+        async with write_lock:
+            writer.write(encode_frame({"id": message.get("id"), **response}))
+            await writer.drain()
+
+    try:
+        while True:
+            message = await read_frame(reader)
+            # Handle requests concurrently so a connection's requests share batches
+            task = asyncio.create_task(answer(message))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        writer.close()
+
+
+async def main():
+    # Load and warm up before listening, so a connected client means a ready guard
+    batcher.engine = load_engine({})
+    path = settings.INFERENCE_SERVER_SOCKET or "/tmp/llm-guard.sock"
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(serve_connection, path=path)
+    # Shut down cleanly (and remove the socket file) on SIGTERM as well as Ctrl+C
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    print(f"Inference server listening on {path}")
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await batcher.stop()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
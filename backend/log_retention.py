@@ -0,0 +1,151 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+from config import settings
+from database import engine
+from models import AuditLog
+
+try:
+    import fcntl
+except ImportError:  # Windows: run a single worker, nothing to coordinate
+    fcntl = None
+
+
+class LogArchiver:
+    """
+    Background retention for AuditLog.
+    Rows older than AUDIT_RETENTION_DAYS are appended to gzip JSONL files, one
+    per day (audit-YYYY-MM-DD.jsonl.gz), then deleted, AUDIT_ARCHIVE_BATCH_SIZE
+    rows per short transaction with a pause in between so the audit writer
+    never waits long for the write lock. A row is written to its archive before
+    it is deleted, so a crash in between can archive it twice but never loses it.
+    Stats rollups are left alone, so /api/stats still covers archived rows.
+    """
+
+    def __init__(self, db_engine, archive_dir: str, retention_days: int, interval_s: float,
+                 batch_size: int, pause_ms: float):
+        self.engine = db_engine
+        self.archive_dir = archive_dir
+        self.retention_days = retention_days
+        self.interval = interval_s
+        self.batch_size = max(1, batch_size)
+        self.pause = max(0.0, pause_ms) / 1000
+        self._task = None
+        self._running = asyncio.Lock()
+
+        self.runs = 0
+        self.archived = 0
+        self.batches = 0
+        self.last_run_at = None
+        self.last_run_ms = 0.0
+        self.last_error = None
+
+    def start(self):
+        if self._task is None and self.retention_days > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.archive_expired()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"ERROR: Audit log archiving failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def archive_expired(self) -> int:
+        """Archives every row past retention; returns the number of rows moved."""
+        if self.retention_days <= 0:
+            return 0
+        async with self._running:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            lock = open(os.path.join(self.archive_dir, ".lock"), "w")
+            try:
+                if fcntl is not None:
+                    try:
+                        # Several workers share the database; one of them archiving is enough
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        return 0
+                started = time.perf_counter()
+                cutoff = datetime.utcnow() - timedelta(days=self.retention_days)
+                moved = 0
+                while True:
+                    count = await asyncio.to_thread(self._archive_batch, cutoff)
+                    moved += count
+                    if count < self.batch_size:
+                        break
+                    await asyncio.sleep(self.pause)
+            finally:
+                lock.close()
+            self.runs += 1
+            self.last_run_at = datetime.utcnow()
+            self.last_run_ms = (time.perf_counter() - started) * 1000
+            self.last_error = None
+            if moved:
+                print(f"Archived {moved} audit logs older than {cutoff:%Y-%m-%d %H:%M}")
+            return moved
+
+    def _archive_batch(self, cutoff: datetime) -> int:
+        with Session(self.engine) as session:
+            rows = session.exec(
+                select(AuditLog).where(AuditLog.timestamp < cutoff).order_by(AuditLog.id).limit(self.batch_size)
+            ).all()
+            if not rows:
+                return 0
+            by_day = {}
+            for row in rows:
+                by_day.setdefault(row.timestamp.date(), []).append(row)
+            for day, day_rows in by_day.items():
+                path = os.path.join(self.archive_dir, f"audit-{day.isoformat()}.jsonl.gz")
+                # Appending adds a gzip member; gzip readers see one continuous file
+                with gzip.open(path, "at", encoding="utf-8") as archive:
+                    for row in day_rows:
+                        archive.write(json.dumps(row.dict(), default=str, ensure_ascii=False) + "\n")
+                    archive.flush()
+                    os.fsync(archive.fileno())
+            session.execute(delete(AuditLog).where(AuditLog.id.in_([row.id for row in rows])))
+            session.commit()
+        self.archived += len(rows)
+        self.batches += 1
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.retention_days > 0,
+            "retention_days": self.retention_days,
+            "archive_dir": os.path.abspath(self.archive_dir),
+            "runs": self.runs,
+            "archived": self.archived,
+            "batches": self.batches,
+            "last_run_at": self.last_run_at,
+            "last_run_ms": self.last_run_ms,
+            "last_error": self.last_error,
+        }
+
+
+log_archiver = LogArchiver(
+    engine,
+    settings.AUDIT_ARCHIVE_DIR,
+    settings.AUDIT_RETENTION_DAYS,
+    settings.AUDIT_RETENTION_INTERVAL_S,
+    settings.AUDIT_ARCHIVE_BATCH_SIZE,
+    settings.AUDIT_ARCHIVE_PAUSE_MS,
+)
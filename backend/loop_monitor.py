@@ -0,0 +1,59 @@
+import asyncio
+import time
+from collections import deque
+
+from config import settings
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop lag: how late a periodic sleep wakes up.
+    Anything that blocks the loop (synchronous inference, DB commits, CPU-heavy
+    parsing) shows up directly as lag.
+    """
+
+    def __init__(self, interval_ms: float, window: int = 600):
+        self.interval = interval_ms / 1000
+        self.samples_ms = deque(maxlen=window)
+        self.max_lag_ms = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.perf_counter() - expected) * 1000)
+            self.samples_ms.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+
+    def stats(self) -> dict:
+        ordered = sorted(self.samples_ms)
+
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+        return {
+            "interval_ms": self.interval * 1000,
+            "samples": len(ordered),
+            "lag_mean_ms": (sum(ordered) / len(ordered)) if ordered else 0.0,
+            "lag_p50_ms": percentile(0.50),
+            "lag_p99_ms": percentile(0.99),
+            "lag_max_window_ms": ordered[-1] if ordered else 0.0,
+            "lag_max_ms": self.max_lag_ms,
+        }
+
+
+loop_monitor = LoopLagMonitor(settings.LOOP_LAG_INTERVAL_MS)
@@ -1,14 +1,33 @@
-from fastapi import FastAPI, Depends, HTTPException, Body
+from fastapi import FastAPI, Depends, HTTPException, Body, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import Session, select, func
-from typing import List, Dict
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlmodel import Session, select
+from typing import List, Dict, Optional
+import re
 import uvicorn
+import time
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 
 from database import create_db_and_tables, engine
-from models import SecurityPolicy, AuditLog
-from proxy_router import router as proxy_router
+from models import SecurityPolicy, AuditLog, FilterRule
+from proxy_router import router as proxy_router, get_stream_stats, speculation_stats
+from bulk_moderation import router as bulk_router
+from batcher import batcher, GuardUnavailable
+from inference_client import inference_client
+from guard import guard_stats
+from model_loader import model_loader
+from loop_monitor import loop_monitor
+from metrics import metrics
+from profiler import profiler
+from verdict_cache import verdict_cache
+from upstream import upstream_pool
+from policy_store import policy_store, bump_version
+from prefilter import prefilter, text_hash
+from risk_codes import RISK_CODES
+from audit_writer import audit_writer
+from log_retention import log_archiver
+from stats_rollup import backfill_rollups, naive_utc, query_stats
 from config import settings
 
 # Default Policies (aligned with YuFeng-XGuard-Reason-0.6B id2risk)
@@ -44,22 +63,68 @@ DEFAULT_RISKS = {
     "md": "Minor Delinquency"
 }
 
+def ensure_default_policies(session: Session):
+    for code, name in DEFAULT_RISKS.items():
+        statement = select(SecurityPolicy).where(SecurityPolicy.risk_category == code)
+        result = session.exec(statement).first()
+        if not result:
+            policy = SecurityPolicy(risk_category=code, risk_name=name, threshold=0.5, enabled=True)
+            session.add(policy)
+    session.commit()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    started = phase_started = time.perf_counter()
+    phases = {}
+
+    def phase_done(name):
+        nonlocal phase_started
+        now = time.perf_counter()
+        phases[name] = now - phase_started
+        phase_started = now
+
     create_db_and_tables()
-    
+    phase_done("database")
+    await upstream_pool.start()
+    phase_done("upstream")
+
+    # Pre-filter lists are versioned together with the policies
+    policy_store.subscribe(prefilter.load)
+
     # Init default policies
     with Session(engine) as session:
-        for code, name in DEFAULT_RISKS.items():
-            statement = select(SecurityPolicy).where(SecurityPolicy.risk_category == code)
-            result = session.exec(statement).first()
-            if not result:
-                policy = SecurityPolicy(risk_category=code, risk_name=name, threshold=0.5, enabled=True)
-                session.add(policy)
-        session.commit()
-    
+        ensure_default_policies(session)
+        policy_store.load(session)
+    phase_done("policies")
+    # One-time: audit logs written before the stats rollups existed (before the writer starts)
+    with Session(engine) as session:
+        backfilled = backfill_rollups(session)
+    if backfilled:
+        print(f"Built stats rollups from {backfilled} existing audit logs")
+        phase_done("stats_backfill")
+    policy_store.start_sync()
+    audit_writer.start()
+    log_archiver.start()
+    loop_monitor.start()
+    # The model loads in the background; the admin API is usable meanwhile
+    model_loader.start()
+    print(
+        f"App startup: {time.perf_counter() - started:.2f}s ("
+        + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in phases.items())
+        + "); guard model loading in background"
+    )
+
     yield
     # Cleanup if needed
+    profiler.stop()
+    await model_loader.stop()
+    await loop_monitor.stop()
+    await batcher.stop()
+    await inference_client.close()
+    await policy_store.stop_sync()
+    await log_archiver.stop()
+    await audit_writer.stop()
+    await upstream_pool.close()
 
 app = FastAPI(title="LLM Security Gateway", lifespan=lifespan)
 
@@ -69,11 +134,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+@app.exception_handler(GuardUnavailable)
+async def guard_unavailable_handler(request: Request, exc: GuardUnavailable):
+    # Fast rejection instead of queueing behind a saturated guard model
+    return JSONResponse(
+        status_code=settings.GUARD_OVERLOAD_STATUS,
+        headers={"Retry-After": str(exc.retry_after)},
+        content={"error": {"message": str(exc), "type": "guard_unavailable"}},
+    )
+
 app.include_router(proxy_router)
 app.include_router(proxy_router, prefix="/api")
 
+# Point-in-time values read at scrape time; the stage histograms come from the spans themselves
+metrics.gauge("gateway_guard_ready", "1 once the guard model is loaded and warm", lambda: int(model_loader.ready))
+metrics.gauge("gateway_guard_pending", "Guard checks queued or in flight in the micro-batcher", lambda: batcher.pending)
+metrics.gauge("gateway_audit_queue_depth", "Audit rows waiting to be written", lambda: audit_writer.stats()["queue_depth"])
+metrics.gauge("gateway_loop_lag_p99_seconds", "Event-loop lag, 99th percentile over the recent window",
+              lambda: loop_monitor.stats()["lag_p99_ms"] / 1000)
+metrics.gauge("gateway_verdict_cache_hit_ratio", "Share of guard lookups answered by the verdict cache",
+              lambda: verdict_cache.stats()["hit_rate"])
+metrics.gauge("gateway_upstream_outstanding", "Requests in flight per upstream backend", lambda: {
+    (("backend", backend["api_base"]),): backend["outstanding"] for backend in upstream_pool.stats()["backends"]
+})
+app.include_router(bulk_router)
+
 def get_session():
     with Session(engine) as session:
         yield session
@@ -93,30 +181,206 @@ def update_policy(policy_id: int, policy_data: SecurityPolicy, session: Session
     policy.threshold = policy_data.threshold
     policy.enabled = policy_data.enabled
     session.add(policy)
+    bump_version(session)
     session.commit()
     session.refresh(policy)
+    # Swap in the new snapshot right away; other workers pick it up via the version counter
+    policy_store.load(session)
     return policy
 
+def _validate_filter(rule: FilterRule):
+    if rule.kind not in ("hash", "phrase"):
+        raise HTTPException(status_code=400, detail="kind must be 'hash' or 'phrase'")
+    if rule.action not in ("deny", "allow"):
+        raise HTTPException(status_code=400, detail="action must be 'deny' or 'allow'")
+    if rule.action == "deny" and rule.risk_category not in RISK_CODES:
+        raise HTTPException(status_code=400, detail="deny rules need a valid risk_category")
+    if not rule.pattern:
+        raise HTTPException(status_code=400, detail="pattern must not be empty")
+    if rule.kind == "hash" and not re.fullmatch(r"[0-9a-f]{64}", rule.pattern):
+        # Plain text given: store only its normalized sha256
+        rule.pattern = text_hash(rule.pattern)
+
+@app.get("/api/filters", response_model=List[FilterRule])
+def get_filters(session: Session = Depends(get_session)):
+    return session.exec(select(FilterRule)).all()
+
+@app.post("/api/filters", response_model=FilterRule)
+def create_filter(rule_data: FilterRule, session: Session = Depends(get_session)):
+    rule = FilterRule(**rule_data.dict(exclude={"id"}))
+    _validate_filter(rule)
+    session.add(rule)
+    bump_version(session)
+    session.commit()
+    session.refresh(rule)
+    # Reloading the snapshot also applies the list change to the pre-filter
+    policy_store.load(session)
+    return rule
+
+@app.put("/api/filters/{filter_id}", response_model=FilterRule)
+def update_filter(filter_id: int, rule_data: FilterRule, session: Session = Depends(get_session)):
+    rule = session.get(FilterRule, filter_id)
+    if not rule:
+        raise HTTPException(status_code=404, detail="Filter not found")
+    for key, value in rule_data.dict(exclude={"id"}).items():
+        setattr(rule, key, value)
+    _validate_filter(rule)
+    session.add(rule)
+    bump_version(session)
+    session.commit()
+    session.refresh(rule)
+    policy_store.load(session)
+    return rule
+
+@app.delete("/api/filters/{filter_id}")
+def delete_filter(filter_id: int, session: Session = Depends(get_session)):
+    rule = session.get(FilterRule, filter_id)
+    if not rule:
+        raise HTTPException(status_code=404, detail="Filter not found")
+    session.delete(rule)
+    bump_version(session)
+    session.commit()
+    policy_store.load(session)
+    return {"deleted": filter_id}
+
+@app.get("/api/prefilter/stats")
+def get_prefilter_stats():
+    # How many prompt checks the pre-filter settled without the model
+    return prefilter.stats()
+
+MAX_LOG_PAGE = 500
+
 @app.get("/api/logs", response_model=List[AuditLog])
-def get_logs(limit: int = 50, session: Session = Depends(get_session)):
-    return session.exec(select(AuditLog).order_by(AuditLog.timestamp.desc()).limit(limit)).all()
+def get_logs(response: Response, limit: int = 50, cursor: Optional[int] = None, since_id: Optional[int] = None,
+             action: Optional[str] = None, category: Optional[str] = None,
+             min_score: Optional[float] = None, max_score: Optional[float] = None,
+             since: Optional[datetime] = None, until: Optional[datetime] = None,
+             session: Session = Depends(get_session)):
+    # Newest first, paged by id (keyset): pass the X-Next-Cursor header back as ?cursor=
+    # for the next page, or the newest id already seen as ?since_id= to fetch only newer rows
+    limit = max(1, min(limit, MAX_LOG_PAGE))
+    query = select(AuditLog)
+    if cursor is not None:
+        query = query.where(AuditLog.id < cursor)
+    if since_id is not None:
+        query = query.where(AuditLog.id > since_id)
+    if action is not None:
+        query = query.where(AuditLog.action == action)
+    if category is not None:
+        query = query.where(AuditLog.blocked_category == category)
+    if min_score is not None:
+        query = query.where(AuditLog.risk_score >= min_score)
+    if max_score is not None:
+        query = query.where(AuditLog.risk_score <= max_score)
+    if since is not None:
+        query = query.where(AuditLog.timestamp >= naive_utc(since))
+    if until is not None:
+        query = query.where(AuditLog.timestamp < naive_utc(until))
+    logs = session.exec(query.order_by(AuditLog.id.desc()).limit(limit)).all()
+    if len(logs) == limit:
+        response.headers["X-Next-Cursor"] = str(logs[-1].id)
+    return logs
+
+@app.get("/api/retention/stats")
+def get_retention_stats():
+    # Audit log archiving: rows moved to the day-partitioned archives and the last run
+    return log_archiver.stats()
+
+@app.post("/api/retention/run")
+async def run_retention():
+    if log_archiver.retention_days <= 0:
+        raise HTTPException(status_code=400, detail="AUDIT_RETENTION_DAYS is 0; retention is disabled")
+    return {"archived": await log_archiver.archive_expired()}
 
 @app.get("/api/stats")
-def get_stats(session: Session = Depends(get_session)):
-    # Simple stats for dashboard
-    total_requests = session.exec(select(func.count(AuditLog.id))).first() or 0
-    blocked_requests = session.exec(select(func.count(AuditLog.id)).where(AuditLog.action != "allow")).first() or 0
-    
-    # Risk distribution (last 100 blocked)
-    # SQLite doesn't support complex JSON queries easily with SQLModel straight away, 
-    # so we might calculate simple stats or add a 'risk_category' column to Log (optimization)
-    # For now, let's just return basics
-    
-    return {
-        "total_requests": total_requests,
-        "blocked_requests": blocked_requests,
-        "block_rate": (blocked_requests / total_requests) if total_requests > 0 else 0
-    }
+def get_stats(since: Optional[datetime] = None, until: Optional[datetime] = None, category: Optional[str] = None,
+              granularity: Optional[str] = None, session: Session = Depends(get_session)):
+    # Dashboard stats, read from the pre-aggregated rollups (all-time unless since/until is given)
+    try:
+        return query_stats(session, since, until, category, granularity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/healthz")
+def healthz():
+    # Liveness: the process is up and serving, whether or not the model is loaded
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    # Readiness: the guard model is loaded and warm (or the shared server answered)
+    return JSONResponse(status_code=200 if model_loader.ready else 503, content=model_loader.stats())
+
+@app.get("/api/engine/stats")
+async def get_engine_stats():
+    # Micro-batch occupancy and prefix reuse of the guard model
+    if settings.INFERENCE_SERVER_SOCKET:
+        stats = await inference_client.stats()
+    else:
+        stats = batcher.stats()
+        if batcher.engine is not None:
+            stats["prefix_cache"] = batcher.engine.prefix_cache.stats()
+            stats["context"] = batcher.engine.context.stats()
+    stats["guard"] = guard_stats
+    return stats
+
+@app.get("/metrics")
+def get_metrics():
+    # Prometheus text exposition of the per-stage histograms and gauges
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/api/profiler/start")
+def start_profiler(interval_ms: Optional[float] = None, duration_s: Optional[float] = None):
+    # Sampling profiler for diagnosing a live instance; stops by itself after PROFILER_MAX_DURATION_S
+    profiler.start(interval_ms, duration_s)
+    return profiler.report()
+
+@app.post("/api/profiler/stop")
+def stop_profiler():
+    profiler.stop()
+    return profiler.report()
+
+@app.get("/api/profiler")
+def get_profile(limit: int = 20):
+    return profiler.report(limit)
+
+@app.get("/api/profiler/collapsed")
+def get_profile_collapsed():
+    # One "frame;frame;... count" line per stack, for flamegraph.pl or speedscope
+    return PlainTextResponse(profiler.collapsed())
+
+@app.get("/api/loop/stats")
+def get_loop_stats():
+    # Event-loop lag; stays near zero as long as nothing blocks the loop
+    return loop_monitor.stats()
+
+@app.get("/api/stream/stats")
+def get_streaming_stats():
+    # Moderation overhead and time-to-first-byte of streamed responses
+    return get_stream_stats()
+
+@app.get("/api/speculation/stats")
+def get_speculation_stats():
+    # Upstream calls started before the prompt verdict and how many were thrown away
+    return speculation_stats
+
+@app.get("/api/upstream/stats")
+def get_upstream_stats():
+    # Per-backend load, health and latency
+    return upstream_pool.stats()
+
+@app.get("/api/audit/stats")
+def get_audit_stats():
+    # Write-behind queue depth, throughput and drops
+    return audit_writer.stats()
+
+@app.get("/api/cache/stats")
+def get_cache_stats():
+    return verdict_cache.stats()
+
+@app.delete("/api/cache")
+def flush_cache():
+    return {"flushed": verdict_cache.flush()}
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
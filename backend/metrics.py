@@ -0,0 +1,152 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from config import settings
+
+# Upper bounds (seconds) shared by every histogram
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Per-request stage breakdown (ms), set by begin_request() and filled in by span()/record()
+_request_timings = ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """Fixed-bucket histogram; observe() may be called from any thread."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _number(value) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Metrics:
+    """
+    In-process metrics rendered in the Prometheus text format at /metrics.
+
+    span(stage) times a block into gateway_stage_seconds{stage=...} and, inside a
+    request started with begin_request(), adds the time to that request's stage
+    breakdown. Gauges are read from callbacks at scrape time, so existing stats
+    counters do not need to be duplicated.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._help = {}
+        self._histograms = {}  # name -> {labels tuple: Histogram}
+        self._gauges = {}  # name -> callback returning a number or {labels tuple: number}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not self.enabled:
+            return
+        key = tuple(labels.items())
+        series = self._histograms.setdefault(name, {})
+        histogram = series.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = series.setdefault(key, Histogram())
+        histogram.observe(seconds)
+
+    def gauge(self, name: str, help_text: str, callback):
+        self._help[name] = help_text
+        self._gauges[name] = callback
+
+    def begin_request(self) -> dict:
+        timings = {}
+        _request_timings.set(timings)
+        return timings
+
+    def record(self, stage: str, seconds: float):
+        # For stages that do not fit a with-block, e.g. time to the first upstream chunk
+        self.observe("gateway_stage_seconds", seconds, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+    def merge(self, timings: dict):
+        # Adds stages timed in another context (the model thread, per batch) to this request's breakdown
+        current = _request_timings.get()
+        if current is not None:
+            for stage, ms in timings.items():
+                current[stage] = current.get(stage, 0.0) + ms
+
+    @contextmanager
+    def span(self, stage: str):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def render(self) -> str:
+        lines = []
+
+        def header(name, kind):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for name, series in sorted(self._histograms.items()):
+            header(name, "histogram")
+            for key, histogram in sorted(series.items()):
+                counts, total, count = histogram.snapshot()
+                labels = dict(key)
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_labels({**labels, 'le': _number(bound)})} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {total!r}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+
+        for name, callback in sorted(self._gauges.items()):
+            try:
+                value = callback()
+            except Exception as e:
+                print(f"WARNING: metric {name} failed: {e}")
+                continue
+            header(name, "gauge")
+            series = value if isinstance(value, dict) else {(): value}
+            for key, number in series.items():
+                lines.append(f"{name}{_labels(dict(key))} {_number(number)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics(settings.METRICS_ENABLED)
+metrics.describe("gateway_stage_seconds", "Time spent per request-handling stage")
+metrics.describe("gateway_request_seconds", "End-to-end latency of logged requests by action")
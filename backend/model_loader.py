@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+from batcher import batcher, GuardUnavailable
+from config import settings
+from inference_client import inference_client
+from policy_store import policy_store
+
+
+def load_engine(timings: dict):
+    """
+    Imports torch/transformers, loads the guard model and warms it up.
+    Phase durations in seconds are recorded in timings.
+    """
+    started = time.perf_counter()
+    from safety_engine import SafetyEngine
+    timings["import_s"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    engine = SafetyEngine()
+    timings["load_s"] = time.perf_counter() - started
+
+    if settings.WARMUP_SEQ_LENS:
+        started = time.perf_counter()
+        engine.warmup(settings.WARMUP_SEQ_LENS, sorted({1, settings.BATCH_MAX_SIZE}))
+        timings["warmup_s"] = time.perf_counter() - started
+
+    print("Model startup: " + ", ".join(f"{name[:-2]} {seconds:.2f}s" for name, seconds in timings.items()))
+    return engine
+
+
+class ModelLoader:
+    """
+    Brings the guard online in the background so the app (admin API, /healthz)
+    is up immediately. Locally the model is loaded and warmed on a worker thread;
+    with INFERENCE_SERVER_SOCKET set we wait for the shared server to answer.
+    Guard checks are rejected with GuardUnavailable until state is "ready".
+    """
+
+    def __init__(self):
+        # idle -> loading -> ready | failed
+        self.state = "idle"
+        self.error = None
+        self.timings = {}
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self):
+        if self._task is None:
+            self.state = "loading"
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        started = time.perf_counter()
+        try:
+            if settings.INFERENCE_SERVER_SOCKET:
+                categories = await self._connect_remote()
+            else:
+                batcher.engine = await asyncio.to_thread(load_engine, self.timings)
+                categories = batcher.engine.categories
+            # Policy thresholds must line up with the engine's category order
+            await asyncio.to_thread(policy_store.set_categories, categories)
+        except Exception as e:
+            self.state, self.error = "failed", str(e)
+            print(f"ERROR: Guard model failed to load: {e}")
+            return
+        self.timings["total_s"] = time.perf_counter() - started
+        self.state = "ready"
+        print(f"Guard ready after {self.timings['total_s']:.2f}s")
+
+    async def _connect_remote(self):
+        # The shared server only listens once its model is warm; retry until then
+        while True:
+            try:
+                await inference_client.connect()
+                return inference_client.categories
+            except GuardUnavailable:
+                await asyncio.sleep(1)
+
+    def stats(self) -> dict:
+        return {"state": self.state, "error": self.error, "timings": self.timings}
+
+
+model_loader = ModelLoader()
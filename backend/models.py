@@ -1,16 +1,24 @@
 from datetime import datetime
 from typing import Optional
+from sqlalchemy import UniqueConstraint
 from sqlmodel import Field, SQLModel
 
 class AuditLog(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: datetime = Field(default_factory=datetime.utcnow, index=True)
     user_input: str
     model_response: Optional[str] = None
     risk_score: Optional[float] = None
     risk_details: Optional[str] = None  # JSON string
-    action: str  # 'allow', 'block_prompt', 'block_response'
+    action: str = Field(index=True)  # 'allow', 'block_prompt', 'block_response', 'client_disconnect', 'guard_unavailable'
     latency_ms: float
+    # Tier that decided: 'model', or 'prefilter:hash' / 'prefilter:phrase' / 'prefilter:heuristic'
+    # when the prompt verdict came from the pre-filter without a model call
+    decided_by: Optional[str] = None
+    # Policy category that blocked the request (None when allowed), for per-category queries
+    blocked_category: Optional[str] = Field(default=None, index=True)
+    # Per-stage breakdown of latency_ms (JSON, ms), stored when AUDIT_STAGE_TIMINGS is on
+    stage_timings: Optional[str] = None
 
 class SecurityPolicy(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -18,3 +26,32 @@ class SecurityPolicy(SQLModel, table=True):
     risk_name: str
     threshold: float = 0.5
     enabled: bool = True
+
+class FilterRule(SQLModel, table=True):
+    # Pre-filter list entry, checked before the guard model
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str  # 'hash' (sha256 of the normalized message) or 'phrase' (substring match)
+    action: str  # 'deny' or 'allow'
+    pattern: str
+    risk_category: Optional[str] = None  # reported category for deny rules
+    enabled: bool = True
+    note: Optional[str] = None
+
+class PolicyVersion(SQLModel, table=True):
+    # Single row, bumped whenever SecurityPolicy or FilterRule changes so workers can reload cheaply
+    id: Optional[int] = Field(default=None, primary_key=True)
+    version: int = 0
+
+class StatsRollup(SQLModel, table=True):
+    # Audit log counters pre-aggregated per time bucket, kept in step by the audit writer.
+    # category is "" for all traffic, otherwise the blocking category (blocked rows only);
+    # latency_le_ms is the upper bound of the row's latency histogram bucket.
+    __table_args__ = (UniqueConstraint("granularity", "bucket", "category", "latency_le_ms"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    granularity: str  # 'minute', 'hour' or 'total'
+    bucket: datetime  # bucket start (UTC)
+    category: str = ""
+    latency_le_ms: float
+    requests: int = 0
+    blocked: int = 0
+    latency_ms_sum: float = 0.0
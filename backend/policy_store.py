@@ -0,0 +1,123 @@
+import asyncio
+from dataclasses import dataclass, field
+
+import numpy as np
+from sqlmodel import Session, select
+
+from config import settings
+from database import engine
+from models import PolicyVersion, SecurityPolicy
+from risk_codes import RISK_CODES
+
+
+@dataclass(frozen=True)
+class PolicySnapshot:
+    """
+    Immutable view of SecurityPolicy at one version.
+    thresholds is aligned with the engine's category order; disabled or missing
+    categories hold +inf so they can never trip the comparison.
+    """
+    version: int
+    categories: tuple
+    thresholds: np.ndarray = field(repr=False)
+
+    def check(self, risk_map: dict):
+        # Returns (is_safe, blocked_category, reason)
+        scores = np.fromiter(
+            (risk_map.get(c, 0.0) for c in self.categories), dtype=np.float64, count=len(self.categories)
+        )
+        over = scores >= self.thresholds
+        if not over.any():
+            return True, None, None
+        # Report the highest-scoring category that crossed its threshold
+        hits = np.flatnonzero(over)
+        category = self.categories[hits[np.argmax(scores[hits])]]
+        # Return generic blocked message with code
+        # Frontend will handle localization
+        return False, category, f"BLOCKED:{category}:{risk_map[category]:.4f}"
+
+
+class PolicyStore:
+    """
+    Holds the current PolicySnapshot in memory.
+    The snapshot is replaced wholesale (a single reference swap) whenever policies
+    change, so request handlers never touch the database to make a block decision.
+    Other worker processes notice changes by polling the PolicyVersion counter.
+    Other in-memory views of versioned tables (e.g. the pre-filter lists) subscribe
+    to be reloaded in the same pass.
+    """
+
+    def __init__(self, categories):
+        self.categories = tuple(categories)
+        self.current = PolicySnapshot(0, self.categories, np.full(len(self.categories), np.inf))
+        self._sync_task = None
+        self._listeners = []
+
+    def subscribe(self, listener):
+        # listener(session) runs after every snapshot load
+        self._listeners.append(listener)
+
+    def load(self, session: Session) -> PolicySnapshot:
+        version = current_version(session)
+        thresholds = np.full(len(self.categories), np.inf)
+        column = {c: i for i, c in enumerate(self.categories)}
+        for policy in session.exec(select(SecurityPolicy)).all():
+            if policy.enabled and policy.risk_category in column:
+                thresholds[column[policy.risk_category]] = policy.threshold
+        thresholds.setflags(write=False)
+        self.current = PolicySnapshot(version, self.categories, thresholds)
+        for listener in self._listeners:
+            listener(session)
+        return self.current
+
+    def set_categories(self, categories):
+        # Realign thresholds when the loaded engine reports a different category order
+        categories = tuple(categories)
+        if categories != self.categories:
+            self.categories = categories
+            with Session(engine) as session:
+                self.load(session)
+
+    def _refresh_if_stale(self):
+        with Session(engine) as session:
+            if current_version(session) != self.current.version:
+                snapshot = self.load(session)
+                print(f"Policy snapshot reloaded (version {snapshot.version})")
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(settings.POLICY_SYNC_INTERVAL_S)
+            try:
+                await asyncio.to_thread(self._refresh_if_stale)
+            except Exception as e:
+                print(f"ERROR: Policy sync failed: {e}")
+
+    def start_sync(self):
+        if settings.POLICY_SYNC_INTERVAL_S > 0 and self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def stop_sync(self):
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            try:
+                await self._sync_task
+            except asyncio.CancelledError:
+                pass
+            self._sync_task = None
+
+
+def current_version(session: Session) -> int:
+    row = session.get(PolicyVersion, 1)
+    return row.version if row else 0
+
+
+def bump_version(session: Session) -> int:
+    # Call inside the transaction that changes SecurityPolicy
+    row = session.get(PolicyVersion, 1) or PolicyVersion(id=1, version=0)
+    row.version += 1
+    session.add(row)
+    return row.version
+
+
+# Starts from the built-in codes; model_loader switches to the engine's order once it is loaded
+policy_store = PolicyStore(RISK_CODES)
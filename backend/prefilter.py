@@ -0,0 +1,156 @@
+import hashlib
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlmodel import Session, select
+
+from aho_corasick import PhraseAutomaton
+from config import settings
+from models import FilterRule
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    # Width/compatibility forms, case and whitespace runs don't change a match
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text).casefold()).strip()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class PrefilterVerdict:
+    action: str  # "deny" or "allow"
+    tier: str    # "prefilter:hash" / "prefilter:phrase" / "prefilter:heuristic"
+    category: Optional[str] = None
+    rule_id: Optional[int] = None
+
+    @property
+    def risk_map(self) -> dict:
+        details = {"_prefilter": {"action": self.action, "tier": self.tier, "rule_id": self.rule_id}}
+        if self.action == "deny":
+            return {self.category: 1.0, **details}
+        return details
+
+    def check(self):
+        # Same shape as PolicySnapshot.check: (is_safe, blocked_category, reason)
+        if self.action == "deny":
+            return False, self.category, f"BLOCKED:{self.category}:1.0000"
+        return True, None, None
+
+
+class Prefilter:
+    """
+    First tier ahead of the guard model for prompt checks.
+    Exact hashes and phrases from the admin-managed FilterRule list, plus optional
+    length/charset heuristics, decide obvious cases without a model call.
+    Deny rules win over allow rules. Allow verdicts (rules and heuristics) only
+    apply when the prompt is the only message with content: a system prompt or
+    earlier turns can change what a short or familiar message means, and are not
+    checked here.
+    Rules are synced incrementally: only added, changed or removed entries touch
+    the hash table and the phrase automaton.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules = {}  # id -> (kind, action, pattern as stored, category)
+        self._hashes = {}  # digest -> {rule id}
+        self._phrases = PhraseAutomaton()
+        self.checks = 0
+        self.decided = {}
+
+    def sync(self, rules):
+        wanted = {rule.id: (rule.kind, rule.action, rule.pattern, rule.risk_category) for rule in rules if rule.enabled}
+        with self._lock:
+            for rule_id in [r for r in self._rules if self._rules[r] != wanted.get(r)]:
+                self._unindex(rule_id, self._rules.pop(rule_id))
+            for rule_id, rule in wanted.items():
+                if rule_id not in self._rules:
+                    self._rules[rule_id] = rule
+                    self._index(rule_id, rule)
+            # Relink now rather than on the next prompt check
+            if self._phrases.stale:
+                self._phrases.link()
+
+    def _index(self, rule_id, rule):
+        kind, _, pattern, _ = rule
+        if kind == "hash":
+            self._hashes.setdefault(pattern, set()).add(rule_id)
+        else:
+            self._phrases.add(normalize(pattern), rule_id)
+
+    def _unindex(self, rule_id, rule):
+        kind, _, pattern, _ = rule
+        if kind == "hash":
+            ids = self._hashes.get(pattern, set())
+            ids.discard(rule_id)
+            if not ids:
+                self._hashes.pop(pattern, None)
+        else:
+            self._phrases.remove(normalize(pattern), rule_id)
+
+    def load(self, session: Session):
+        self.sync(session.exec(select(FilterRule)).all())
+
+    def check(self, messages) -> Optional[PrefilterVerdict]:
+        """Returns a verdict for the prompt check, or None to fall through to the model."""
+        if not settings.PREFILTER_ENABLED:
+            return None
+        last_user = next((m for m in reversed(messages) if m["role"] == "user"), None)
+        if last_user is None:
+            return None
+        self.checks += 1
+        text = normalize(last_user["content"] or "")
+        # Allow verdicts only cover the text checked here, so nothing else may carry content
+        # (a system prompt next to an allow-listed "hello" still goes to the model)
+        only_prompt = not any((m["content"] or "").strip() for m in messages if m is not last_user)
+
+        with self._lock:
+            hash_ids = self._hashes.get(hashlib.sha256(text.encode("utf-8")).hexdigest(), ())
+            phrase_ids = self._phrases.search(text) if len(self._phrases) else ()
+            hits = [(rule_id, "prefilter:hash") for rule_id in hash_ids]
+            hits += [(rule_id, "prefilter:phrase") for rule_id in phrase_ids]
+            hits = [(rule_id, tier, self._rules[rule_id]) for rule_id, tier in hits]
+
+        # Lowest id first so the verdict is stable when several rules match
+        for rule_id, tier, (_, action, _, category) in sorted(hits, key=lambda hit: hit[0]):
+            if action == "deny":
+                return self._decide(PrefilterVerdict("deny", tier, category, rule_id))
+        if not only_prompt:
+            return None
+        for rule_id, tier, (_, action, _, _) in sorted(hits, key=lambda hit: hit[0]):
+            if action == "allow":
+                return self._decide(PrefilterVerdict("allow", tier, rule_id=rule_id))
+        if len(text) < settings.PREFILTER_MIN_CHARS:
+            return self._decide(PrefilterVerdict("allow", "prefilter:heuristic"))
+        if settings.PREFILTER_ALLOW_NO_LETTERS and not any(ch.isalpha() for ch in text):
+            return self._decide(PrefilterVerdict("allow", "prefilter:heuristic"))
+        return None
+
+    def _decide(self, verdict: PrefilterVerdict) -> PrefilterVerdict:
+        key = f"{verdict.action}:{verdict.tier}"
+        self.decided[key] = self.decided.get(key, 0) + 1
+        return verdict
+
+    def stats(self) -> dict:
+        decided = sum(self.decided.values())
+        return {
+            "enabled": settings.PREFILTER_ENABLED,
+            "rules": len(self._rules),
+            "hashes": len(self._hashes),
+            "phrases": len(self._phrases),
+            "automaton_compactions": self._phrases.rebuilds,
+            "checks": self.checks,
+            "decided": self.decided,
+            "model_calls_saved": decided,
+            "saved_ratio": decided / self.checks if self.checks else 0.0,
+        }
+
+
+prefilter = Prefilter()
@@ -0,0 +1,120 @@
+import hashlib
+from array import array
+from collections import Counter, OrderedDict
+
+
+def _digest(token_bytes: bytes) -> bytes:
+    return hashlib.blake2b(token_bytes, digest_size=16).digest()
+
+
+class KVPrefixCache:
+    """
+    Byte-budgeted LRU store of past_key_values keyed by token-prefix hash.
+    Each stored sequence can be indexed at several prefix lengths (the full
+    sequence, and the point just before the template's end-of-turn tail), so
+    the next turn of a conversation or a longer streamed reply can reuse it
+    and only prefill the new suffix.
+    Not thread-safe: only the engine's inference thread touches it.
+    """
+
+    def __init__(self, max_bytes: int, min_prefix_tokens: int):
+        self.max_bytes = max_bytes
+        self.min_prefix_tokens = max(1, min_prefix_tokens)
+        self._records = OrderedDict()  # record id -> (kv layers, prefix digests, nbytes)
+        self._index = {}  # prefix digest -> (record id, prefix length)
+        self._lengths = Counter()  # prefix length -> number of indexed prefixes
+        self._next_id = 0
+        self.used_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def _token_bytes(token_ids) -> bytes:
+        return array("q", token_ids).tobytes()
+
+    def lookup(self, token_ids, max_length: int):
+        """
+        Returns (kv layers, prefix length) for the longest cached prefix of
+        token_ids no longer than max_length, or None.
+        """
+        token_bytes = self._token_bytes(token_ids)
+        width = len(token_bytes) // max(1, len(token_ids))
+        for length in sorted(self._lengths, reverse=True):
+            if length > max_length or length < self.min_prefix_tokens:
+                continue
+            found = self._index.get(_digest(token_bytes[:length * width]))
+            if found is None:
+                continue
+            record_id, prefix_length = found
+            self._records.move_to_end(record_id)
+            self.hits += 1
+            return self._records[record_id][0], prefix_length
+        self.misses += 1
+        return None
+
+    def store(self, token_ids, kv_layers, prefix_lengths, nbytes: int):
+        if not self.enabled or nbytes > self.max_bytes:
+            return
+        token_bytes = self._token_bytes(token_ids)
+        width = len(token_bytes) // max(1, len(token_ids))
+
+        record_id = self._next_id
+        self._next_id += 1
+        digests = []
+        for length in sorted(set(prefix_lengths)):
+            if length < self.min_prefix_tokens or length > len(token_ids):
+                continue
+            digest = _digest(token_bytes[:length * width])
+            if digest not in self._index:
+                self._lengths[length] += 1
+            # Point at the newest record so the prefix survives the old one's eviction
+            self._index[digest] = (record_id, length)
+            digests.append((digest, length))
+        if not digests:
+            return
+
+        self._records[record_id] = (kv_layers, digests, nbytes)
+        self.used_bytes += nbytes
+        while self.used_bytes > self.max_bytes and self._records:
+            self._evict()
+
+    def _evict(self):
+        record_id, (_, digests, nbytes) = self._records.popitem(last=False)
+        for digest, length in digests:
+            if self._index.get(digest, (None,))[0] != record_id:
+                continue
+            del self._index[digest]
+            self._lengths[length] -= 1
+            if self._lengths[length] <= 0:
+                del self._lengths[length]
+        self.used_bytes -= nbytes
+        self.evictions += 1
+
+    def clear(self):
+        self._records.clear()
+        self._index.clear()
+        self._lengths.clear()
+        self.used_bytes = 0
+
+    def stats(self) -> dict:
+        total = self.reused_tokens + self.prefilled_tokens
+        return {
+            "enabled": self.enabled,
+            "max_bytes": self.max_bytes,
+            "used_bytes": self.used_bytes,
+            "entries": len(self._records),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "reused_tokens": self.reused_tokens,
+            "prefilled_tokens": self.prefilled_tokens,
+            "prefill_savings": (self.reused_tokens / total) if total > 0 else 0,
+        }
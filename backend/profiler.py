@@ -0,0 +1,104 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from config import settings
+
+MAX_DEPTH = 64
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for a live gateway.
+    While running, a daemon thread snapshots every other thread's Python stack
+    each interval and counts identical stacks, so cost is one stack walk per
+    thread per sample regardless of request rate. It stops by itself after
+    max_duration_s. Results are served as top stacks/functions or in collapsed
+    form for flamegraph.pl / speedscope.
+    """
+
+    def __init__(self, default_interval_ms: float, max_duration_s: float):
+        self.default_interval_ms = default_interval_ms
+        self.max_duration_s = max_duration_s
+        self.interval = default_interval_ms / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms: float = None, duration_s: float = None):
+        # Restarting clears the previous profile
+        self.stop()
+        self.interval = max(1.0, interval_ms or self.default_interval_ms) / 1000
+        duration = min(duration_s or self.max_duration_s, self.max_duration_s)
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self.stopped_at = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(duration,), name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, duration):
+        me = threading.get_ident()
+        deadline = time.monotonic() + duration
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sample = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                sample.append(";".join(reversed(stack)))
+            with self._lock:
+                self.stacks.update(sample)
+                self.samples += 1
+        self.stopped_at = time.time()
+
+    def collapsed(self) -> str:
+        with self._lock:
+            stacks = self.stacks.copy()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def report(self, limit: int = 20) -> dict:
+        with self._lock:
+            stacks = self.stacks.copy()
+        leaf = Counter()
+        for stack, count in stacks.items():
+            leaf[stack.rsplit(";", 1)[-1]] += count
+        total = sum(stacks.values()) or 1
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000,
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "samples": self.samples,
+            # Where threads were when sampled (idle threads show their wait call)
+            "top_functions": [
+                {"function": name, "samples": count, "share": count / total} for name, count in leaf.most_common(limit)
+            ],
+            "top_stacks": [{"stack": stack, "samples": count} for stack, count in stacks.most_common(limit)],
+        }
+
+
+profiler = SamplingProfiler(settings.PROFILER_INTERVAL_MS, settings.PROFILER_MAX_DURATION_S)
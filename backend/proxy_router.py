@@ -1,67 +1,160 @@
-import httpx
 import time
 import json
 import uuid
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlmodel import Session, select
+import asyncio
+from contextlib import aclosing
+from collections import deque
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Request
 from datetime import datetime
 
-from database import engine, create_db_and_tables
-from models import AuditLog, SecurityPolicy
+from audit_writer import audit_writer, audit_row
 from config import settings
 from schemas import ChatCompletionRequest, ChatCompletionResponse, ChatMessage, ChatCompletionResponseChoice
-from safety_engine import safety_engine
+from guard import score_messages
+from metrics import metrics
+from batcher import GuardUnavailable
+from policy_store import policy_store
+from prefilter import prefilter
+from sse import SSEDeltaParser
+from upstream import upstream_pool
 
 router = APIRouter()
 
-def get_session():
-    with Session(engine) as session:
-        yield session
+async def log_request(user_input: str, response: str, risk_score: float, risk_details: dict, action: str, latency: float,
+                      decided_by: str = "model", blocked_category: str = None, stage_timings: dict = None):
+    # Only enqueues; the audit writer persists rows in batches off the request path
+    metrics.observe("gateway_request_seconds", latency / 1000, action=action)
+    if not settings.AUDIT_STAGE_TIMINGS:
+        stage_timings = None
+    row = audit_row(user_input, response, risk_score, risk_details, action, latency, decided_by, blocked_category, stage_timings)
+    with metrics.span("audit_enqueue"):
+        await audit_writer.submit(row)
 
-def log_request(user_input: str, response: str, risk_score: float, risk_details: dict, action: str, latency: float):
-    print(f"DEBUG: Saving Log with details: {risk_details}")
-    try:
-        with Session(engine) as session:
-            log = AuditLog(
-                user_input=user_input,
-                model_response=response,
-                risk_score=risk_score,
-                risk_details=json.dumps(risk_details),
-                action=action,
-                latency_ms=latency
-            )
-            session.add(log)
-            session.commit()
-    except Exception as e:
-        print(f"ERROR: Failed to save log: {e}")
+# Audit tasks started from a response that is being cancelled, kept referenced until they finish
+_detached_logs = set()
+
+def log_request_detached(*args):
+    # A cancelled stream cannot await anything, so the row is enqueued from its own task
+    task = asyncio.get_running_loop().create_task(log_request(*args))
+    _detached_logs.add(task)
+    task.add_done_callback(_detached_logs.discard)
 
 # Helper to check risk against policies
-def check_risk(risk_map: dict, session: Session) -> (bool, str, str):
-    # Returns (is_safe, blocked_category, reason)
-    policies = session.exec(select(SecurityPolicy)).all()
-    policy_map = {p.risk_category: p for p in policies if p.enabled}
-    
-    max_score = 0.0
-    
-    for category, score in risk_map.items():
-        if score > max_score:
-            max_score = score
+def check_risk(risk_map: dict) -> (bool, str, str):
+    # Returns (is_safe, blocked_category, reason), judged against the in-memory policy snapshot
+    with metrics.span("policy"):
+        return policy_store.current.check(risk_map)
+
+
+async def fetch_completion(request: ChatCompletionRequest):
+    # Returns (assistant_content, upstream_data) for a blocking upstream call
+    try:
+        upstream_data = await upstream_pool.post_json(request.dict())
+        
+        # Extract assistant response
+        assistant_content = upstream_data['choices'][0]['message']['content']
             
-        # Check against policy
-        if category in policy_map:
-            policy = policy_map[category]
-            threshold = policy.threshold
-            if score >= threshold:
-                # Return generic blocked message with code
-                # Frontend will handle localization
-                return False, category, f"BLOCKED:{category}:{score:.4f}"
+    except Exception as e:
+        # Fallback handling
+        print(f"Upstream error: {e}")
+        # Return mock response if upstream fails?
+        assistant_content = "Error: Unable to contact upstream LLM."
+        upstream_data = {
+            "id": "error", "created": int(time.time()), "model": request.model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": assistant_content}, "finish_reason": "stop"}]
+        }
+    return assistant_content, upstream_data
+
+async def upstream_chunks(request: ChatCompletionRequest):
+    # Body of a streaming upstream call, as the network delivers it
+    async with upstream_pool.stream(request.dict()) as response:
+        async for data in response.aiter_bytes():
+            yield data
+
+# Upstream work started before the prompt verdict, served by /api/speculation/stats
+speculation_stats = {
+    "dispatched": 0,
+    "cancelled": 0,
+    # Cancelled after the upstream had already answered (blocking) or started streaming
+    "cancelled_with_output": 0,
+    "wasted_completion_tokens": 0,
+    "wasted_stream_chunks": 0,
+}
 
-    return True, None, None
+class UpstreamStream:
+    """
+    Reads a streaming upstream call into a buffer from its own task, so it can be
+    started before the prompt verdict (speculation) and cancelled the moment the
+    client goes away. Nothing reaches the client until the stream is drained with chunks().
+    """
 
+    _END = object()
+
+    def __init__(self, request: ChatCompletionRequest):
+        self.buffer = asyncio.Queue()
+        self.chunks_read = 0
+        self.cancelled = False
+        self.task = asyncio.create_task(self._pump(request))
+
+    async def _pump(self, request):
+        started = time.perf_counter()
+        try:
+            async for data in upstream_chunks(request):
+                if not self.chunks_read:
+                    metrics.record("upstream_ttft", time.perf_counter() - started)
+                self.chunks_read += data.count(b"data:")
+                self.buffer.put_nowait(data)
+        except Exception as e:
+            self.buffer.put_nowait(e)
+        finally:
+            self.buffer.put_nowait(self._END)
+
+    async def chunks(self):
+        try:
+            while True:
+                item = await self.buffer.get()
+                if item is self._END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.task.cancel()
+
+    def cancel(self):
+        self.cancelled = True
+        self.task.cancel()
+
+async def watch_disconnect(http_request: Request, upstream: UpstreamStream):
+    # The request body has already been read, so the next ASGI message is the disconnect
+    while True:
+        message = await http_request.receive()
+        if message["type"] == "http.disconnect":
+            upstream.cancel()
+            return
+
+def cancel_speculation(speculative):
+    if speculative is None:
+        return
+    speculation_stats["cancelled"] += 1
+    if isinstance(speculative, UpstreamStream):
+        if speculative.chunks_read:
+            speculation_stats["cancelled_with_output"] += 1
+            speculation_stats["wasted_stream_chunks"] += speculative.chunks_read
+        speculative.cancel()
+        return
+    if speculative.done() and not speculative.cancelled():
+        speculation_stats["cancelled_with_output"] += 1
+        _, upstream_data = speculative.result()
+        usage = upstream_data.get("usage") or {}
+        speculation_stats["wasted_completion_tokens"] += usage.get("completion_tokens", 0)
+    speculative.cancel()
 
 @router.post("/v1/chat/completions", response_model=ChatCompletionResponse)
-async def chat_completions(request: ChatCompletionRequest, background_tasks: BackgroundTasks, session: Session = Depends(get_session)):
+async def chat_completions(request: ChatCompletionRequest, background_tasks: BackgroundTasks, http_request: Request):
     start_time = time.time()
+    # Spans below add to this per-request breakdown (stored on the audit row if AUDIT_STAGE_TIMINGS)
+    timings = metrics.begin_request()
     
     # 1. Extract User Prompt
     # We only check the LAST user message usually, or all? 
@@ -73,20 +166,43 @@ async def chat_completions(request: ChatCompletionRequest, background_tasks: Bac
         # Pass through if no user content?
         pass
 
-    # 2. Prompt Safety Check
     # We construct a list of dicts for infer
     msgs_for_check = [{"role": m.role, "content": m.content} for m in request.messages]
-    
-    # Infer
-    risk_map = safety_engine.infer(msgs_for_check, check_response=False)
-    
-    # Check Policy
-    is_safe, blocked_cat, reason = check_risk(risk_map, session)
+
+    # Tier 1: hash/phrase lists and heuristics settle obvious prompts without a model call
+    with metrics.span("prefilter"):
+        prefiltered = prefilter.check(msgs_for_check)
+    prompt_tier = prefiltered.tier if prefiltered else "model"
+
+    # Speculative mode: start the upstream call now and only release it once the prompt passes
+    speculative = None
+    if settings.SPECULATIVE_UPSTREAM and prefiltered is None:
+        speculation_stats["dispatched"] += 1
+        if request.stream:
+            speculative = UpstreamStream(request)
+        else:
+            speculative = asyncio.create_task(fetch_completion(request))
+
+    # 2. Prompt Safety Check
+    if prefiltered is not None:
+        risk_map = prefiltered.risk_map
+        is_safe, blocked_cat, reason = prefiltered.check()
+    else:
+        try:
+            with metrics.span("guard_prompt"):
+                risk_map = await score_messages(msgs_for_check, check_response=False)
+        except BaseException:
+            cancel_speculation(speculative)
+            raise
+
+        # Check Policy
+        is_safe, blocked_cat, reason = check_risk(risk_map)
     
     if not is_safe:
+        cancel_speculation(speculative)
         latency = (time.time() - start_time) * 1000
         # Log raw risk map
-        background_tasks.add_task(log_request, user_content, None, risk_map.get(blocked_cat, 0), risk_map, "block_prompt", latency)
+        background_tasks.add_task(log_request, user_content, None, risk_map.get(blocked_cat, 0), risk_map, "block_prompt", latency, prompt_tier, blocked_cat, timings)
         
         return ChatCompletionResponse(
             id=f"chatcmpl-{uuid.uuid4()}",
@@ -104,45 +220,29 @@ async def chat_completions(request: ChatCompletionRequest, background_tasks: Bac
     # 3. Forward to Upstream LLM
     # Handle Streaming
     if request.stream:
-        return await handle_streaming_response(request, user_content, session, background_tasks)
+        return await handle_streaming_response(request, user_content, background_tasks, http_request, prefetched=speculative,
+                                               prompt_tier=prompt_tier, timings=timings)
 
     # Standard Blocking Request
-    try:
-        async with httpx.AsyncClient() as client:
-            upstream_response = await client.post(
-                f"{settings.UPSTREAM_API_BASE}/chat/completions",
-                headers={"Authorization": f"Bearer {settings.UPSTREAM_API_KEY}"},
-                json=request.dict(),
-                timeout=60.0
-            )
-            upstream_response.raise_for_status()
-            upstream_data = upstream_response.json()
-            
-            # Extract assistant response
-            assistant_content = upstream_data['choices'][0]['message']['content']
-            
-    except Exception as e:
-        # Fallback handling
-        print(f"Upstream error: {e}")
-        # Return mock response if upstream fails?
-        assistant_content = "Error: Unable to contact upstream LLM."
-        upstream_data = {
-            "id": "error", "created": int(time.time()), "model": request.model,
-            "choices": [{"index": 0, "message": {"role": "assistant", "content": assistant_content}, "finish_reason": "stop"}]
-        }
+    with metrics.span("upstream"):
+        if speculative is not None:
+            assistant_content, upstream_data = await speculative
+        else:
+            assistant_content, upstream_data = await fetch_completion(request)
 
     # 4. Response Safety Check
     # Append assistant response to messages
     msgs_for_check_resp = msgs_for_check + [{"role": "assistant", "content": assistant_content}]
     
-    resp_risk_map = safety_engine.infer(msgs_for_check_resp, check_response=True)
-    is_safe_resp, blocked_cat_resp, reason_resp = check_risk(resp_risk_map, session)
+    with metrics.span("guard_response"):
+        resp_risk_map = await score_messages(msgs_for_check_resp, check_response=True)
+    is_safe_resp, blocked_cat_resp, reason_resp = check_risk(resp_risk_map)
     
     latency = (time.time() - start_time) * 1000
     
     if not is_safe_resp:
         # Block Response
-        background_tasks.add_task(log_request, user_content, assistant_content, resp_risk_map.get(blocked_cat_resp, 0), resp_risk_map, "block_response", latency)
+        background_tasks.add_task(log_request, user_content, assistant_content, resp_risk_map.get(blocked_cat_resp, 0), resp_risk_map, "block_response", latency, "model", blocked_cat_resp, timings)
         
         return ChatCompletionResponse(
             id=f"chatcmpl-{uuid.uuid4()}",
@@ -158,7 +258,7 @@ async def chat_completions(request: ChatCompletionRequest, background_tasks: Bac
         )
     
     # 5. Allow
-    background_tasks.add_task(log_request, user_content, assistant_content, 0.0, resp_risk_map, "allow", latency)
+    background_tasks.add_task(log_request, user_content, assistant_content, 0.0, resp_risk_map, "allow", latency, prompt_tier, None, timings)
     
     # Construct response from upstream data
     # We basically pass through upstream_data but need to cast to our model
@@ -166,67 +266,197 @@ async def chat_completions(request: ChatCompletionRequest, background_tasks: Bac
 
 from fastapi.responses import StreamingResponse
 
-async def handle_streaming_response(request: ChatCompletionRequest, user_content: str, session: Session, background_tasks: BackgroundTasks):
+# Aggregate cost of moderating streamed responses, served by /api/stream/stats
+stream_stats = {
+    "streams": 0,
+    "blocked_mid_stream": 0,
+    "blocked_on_final_check": 0,
+    "checks": 0,
+    "scoring_ms": 0.0,
+    "ttfb_ms": 0.0,
+    # Streams whose client went away; the upstream call is cancelled, the final check skipped
+    # and the partial reply logged as "client_disconnect"
+    "client_disconnects": 0,
+    "relayed_bytes": 0,
+    "relay_writes": 0,
+}
+
+def get_stream_stats() -> dict:
+    streams = stream_stats["streams"] or 1
+    return {
+        **stream_stats,
+        "checks_per_stream": stream_stats["checks"] / streams,
+        "mean_scoring_ms_per_stream": stream_stats["scoring_ms"] / streams,
+        "mean_ttfb_ms": stream_stats["ttfb_ms"] / streams,
+        "check_interval_chars": settings.STREAM_CHECK_INTERVAL_CHARS,
+        "holdback_chars": settings.STREAM_HOLDBACK_CHARS,
+    }
+
+def block_chunk(request: ChatCompletionRequest, reason: str) -> bytes:
+    # Terminal SSE event replacing the rest of a stream that crossed a policy threshold
+    chunk = {
+        "id": f"chatcmpl-{uuid.uuid4()}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": request.model,
+        "choices": [{"index": 0, "delta": {"content": reason}, "finish_reason": "content_filter"}],
+    }
+    return f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode()
+
+async def handle_streaming_response(request: ChatCompletionRequest, user_content: str, background_tasks: BackgroundTasks, http_request: Request,
+                                    prefetched: UpstreamStream = None, prompt_tier: str = "model", timings: dict = None):
     start_time = time.time()
+    incremental = settings.STREAM_MODERATION
+    # The client only receives text once it is this far behind the upstream head,
+    # which gives the moderator room to cut the stream before unsafe text is relayed.
+    holdback = settings.STREAM_HOLDBACK_CHARS if incremental else 0
+    interval = max(1, settings.STREAM_CHECK_INTERVAL_CHARS)
+    msgs_context = [{"role": m.role, "content": m.content} for m in request.messages]
     
     async def stream_generator():
-        full_content = ""
-        client = httpx.AsyncClient()
+        chunks = []
+        length = 0
+        scored_length = 0
+        pending = deque()  # (content length after these events, event bytes)
+        risk_map = {}
+        blocked = None
+        cut_early = False
+        first_byte_at = None
+        checks = 0
+        scoring_ms = 0.0
+
+        async def moderate(check_cached: bool):
+            # Returns (risk_map, blocked) where blocked is None or (risk_map, category, reason);
+            # category is None when the stream was cut because the guard was unavailable
+            nonlocal checks, scoring_ms
+            t0 = time.perf_counter()
+            context = msgs_context + [{"role": "assistant", "content": "".join(chunks)}]
+            try:
+                # Intermediate windows are never repeated, so keep them out of the verdict cache
+                with metrics.span("guard_stream"):
+                    risk_map = await score_messages(context, check_response=True, cached=check_cached)
+            except GuardUnavailable as e:
+                # Fail-closed mid-stream: the headers are already sent, so end the stream instead
+                # No category: the row is logged as "guard_unavailable", not as a policy block
+                print(f"Stream Guard Unavailable: {e}")
+                return {}, ({}, None, "BLOCKED:guard_unavailable:1.0000")
+            finally:
+                checks += 1
+                scoring_ms += (time.perf_counter() - t0) * 1000
+            is_safe, blocked_cat, reason = check_risk(risk_map)
+            return risk_map, (None if is_safe else (risk_map, blocked_cat, reason))
+
+        # Upstream bytes are relayed as received, cut only at SSE event boundaries;
+        # just the delta text is decoded, for moderation and the audit log
+        upstream = prefetched if prefetched is not None else UpstreamStream(request)
+        watcher = asyncio.create_task(watch_disconnect(http_request, upstream))
+        parser = SSEDeltaParser()
+        writes = 0
+        relayed = 0
+
+        def take(events, deltas):
+            nonlocal length
+            for text in deltas:
+                chunks.append(text)
+                length += len(text)
+            if events:
+                pending.append((length, events))
+
+        def release(limit):
+            # Everything held back up to `limit` content chars, joined into one write
+            out = []
+            while pending and pending[0][0] <= limit:
+                out.append(pending.popleft()[1])
+            return b"".join(out)
+
+        def blocked_action():
+            return "block_response_stream" if blocked[1] is not None else "guard_unavailable"
+
+        def log_disconnect():
+            stream_stats["client_disconnects"] += 1
+            latency = (time.time() - start_time) * 1000
+            partial = "".join(chunks)
+            if blocked is not None:
+                blocked_map, blocked_cat, _ = blocked
+                log_request_detached(user_content, partial, blocked_map.get(blocked_cat, 0.0), blocked_map,
+                                     blocked_action(), latency, "model", blocked_cat, timings)
+            else:
+                # Only the windows scored so far back this row; the last risk map is kept
+                log_request_detached(user_content, partial, 0.0, risk_map, "client_disconnect", latency,
+                                     prompt_tier, None, timings)
+
+        source = upstream.chunks()
         try:
-            async with client.stream(
-                "POST",
-                f"{settings.UPSTREAM_API_BASE}/chat/completions",
-                headers={"Authorization": f"Bearer {settings.UPSTREAM_API_KEY}"},
-                json=request.dict(),
-                timeout=60.0
-            ) as response:
-                response.raise_for_status()
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        body = line[6:] # Strip "data: "
-                        if body != "[DONE]":
-                            try:
-                                json_body = json.loads(body)
-                                # Accumulate content for audit
-                                if "choices" in json_body and len(json_body["choices"]) > 0:
-                                    delta = json_body["choices"][0].get("delta", {})
-                                    if "content" in delta:
-                                        full_content += delta["content"]
-                            except:
-                                pass
-                    yield line + "\n"
+            async with aclosing(source):
+                async for data in source:
+                    take(*parser.feed(data))
+
+                    if incremental and length - scored_length >= interval:
+                        risk_map, blocked = await moderate(check_cached=False)
+                        scored_length = length
+                        if blocked is not None:
+                            cut_early = True
+                            break
+
+                    # Never past the last scored point, whatever holdback and interval are set to
+                    out = release(min(length - holdback, scored_length) if incremental else length)
+                    if out:
+                        if first_byte_at is None:
+                            first_byte_at = time.time()
+                        writes += 1
+                        relayed += len(out)
+                        yield out
+            if blocked is None:
+                take(*parser.flush())
+        except (asyncio.CancelledError, GeneratorExit):
+            # Starlette cancels the response itself when it notices the disconnect first
+            upstream.cancel()
+            log_disconnect()
+            raise
         except Exception as e:
             print(f"Stream Error: {e}")
-            yield f'data: {{"error": "{str(e)}"}}\n\n'
+            pending.append((length, ("data: " + json.dumps({"error": str(e)}) + "\n\n").encode()))
         finally:
-            await client.aclose()
-            
-            # Post-Stream Audit (Async)
-            latency = (time.time() - start_time) * 1000
-            
-            # 1. Infer risk on full content
-            # Reconstruct messages context
-            msgs_context = [{"role": m.role, "content": m.content} for m in request.messages]
-            msgs_context.append({"role": "assistant", "content": full_content})
-            
-            risk_map = safety_engine.infer(msgs_context, check_response=True)
-            is_safe, blocked_cat, reason = check_risk(risk_map, session)
-            
-            if not is_safe:
-               # Log as blocked (even though user saw it - Stream tradeoff)
-               # Use a special action 'audit_fail_stream' ? Or just block_response
-               print(f"Stream Audit Failed: {blocked_cat}")
-               # We use a new session since the passed one might be closed/unsafe in generator? 
-               # Actually log_request creates its own session.
-               await log_request_async(user_content, full_content, risk_map.get(blocked_cat, 0), risk_map, "block_response_stream", latency)
-            else:
-               await log_request_async(user_content, full_content, 0.0, risk_map, "allow", latency)
+            watcher.cancel()
 
-    return StreamingResponse(stream_generator(), media_type="text/event-stream")
+        if upstream.cancelled:
+            # Client disconnected: skip the final check, nobody is left to receive it
+            log_disconnect()
+            return
+
+        # Final check on the full reply before releasing the held-back tail
+        if blocked is None:
+            risk_map, blocked = await moderate(check_cached=True)
+
+        if blocked is None:
+            out = release(length)
+        else:
+            out = block_chunk(request, blocked[2])
+        if out and first_byte_at is None:
+            first_byte_at = time.time()
 
-async def log_request_async(user_input, response, risk_score, risk_details, action, latency):
-    # Wrapper to run sync log_request in threadpool if needed, but log_request is sync.
-    # We can just call it directly since we are in async generator (blocking loop slightly but ok for log)
-    # Better: Use same logic as background tasks but we are inside the generator which is async.
-    # We can just call the synchronous log_request here, it's fast enough DB write.
-    log_request(user_input, response, risk_score, risk_details, action, latency)
+        # Logged before the last write, so a client leaving now cannot drop the row
+        full_content = "".join(chunks)
+        latency = (time.time() - start_time) * 1000
+        stream_stats["streams"] += 1
+        stream_stats["checks"] += checks
+        stream_stats["scoring_ms"] += scoring_ms
+        stream_stats["ttfb_ms"] += ((first_byte_at or time.time()) - start_time) * 1000
+        if blocked is None and out:
+            writes += 1
+            relayed += len(out)
+        stream_stats["relayed_bytes"] += relayed
+        stream_stats["relay_writes"] += writes
+
+        if blocked is not None:
+            risk_map, blocked_cat, _ = blocked
+            stream_stats["blocked_mid_stream" if cut_early else "blocked_on_final_check"] += 1
+            print(f"Stream Audit Failed: {blocked_cat or 'guard_unavailable'}")
+            await log_request(user_content, full_content, risk_map.get(blocked_cat, 0.0), risk_map, blocked_action(), latency, "model", blocked_cat, timings)
+        else:
+            await log_request(user_content, full_content, 0.0, risk_map, "allow", latency, prompt_tier, None, timings)
+
+        if out:
+            yield out
+
+    return StreamingResponse(stream_generator(), media_type="text/event-stream")
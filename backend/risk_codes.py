@@ -0,0 +1,7 @@
+# Risk codes emitted by YuFeng-XGuard-Reason-0.6B as its first generated token.
+# "sec" (Safe) is included so callers can see the safe probability as well.
+# Kept free of torch/transformers so policy and admin code can import it cheaply.
+RISK_CODES = (
+    'dw', 'pc', 'dc', 'pi', 'ec', 'ac', 'def', 'ti', 'cy', 'ph', 'mh', 'se', 'sci', 'pp',
+    'cs', 'acc', 'mc', 'ha', 'ps', 'ter', 'sd', 'ext', 'fin', 'med', 'law', 'cm', 'ma', 'md', 'sec'
+)
@@ -1,43 +1,254 @@
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache
 from config import settings
+from context_window import ContextPolicy
+from metrics import metrics
+from prefix_cache import KVPrefixCache
+from risk_codes import RISK_CODES
+
+
+def _load_reference(model_path, device):
+    return AutoModelForCausalLM.from_pretrained(
+        model_path,
+        torch_dtype="auto",
+        device_map=device
+    ).eval()
+
+
+def _load_cpu_int8(model_path, device):
+    # Dynamic int8: Linear weights are quantized once at load time, activations
+    # are quantized on the fly. Attention, norms and embeddings stay in float32.
+    from torch.ao.quantization import quantize_dynamic
+    model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32).eval()
+    return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+# Settings.DEVICE values that need more than from_pretrained(device_map=DEVICE).
+# Anything else ("auto", "cuda", "cpu", ...) goes through the reference loader.
+MODEL_BACKENDS = {
+    "cpu-int8": _load_cpu_int8,
+}
+
+
+def configure_cpu_threads():
+    if settings.CPU_THREADS > 0:
+        torch.set_num_threads(settings.CPU_THREADS)
+    if settings.CPU_INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(settings.CPU_INTEROP_THREADS)
+        except RuntimeError:
+            # Only allowed before the first parallel op; keep whatever is set
+            pass
+
 
 class SafetyEngine:
-    def __init__(self):
-        print(f"Loading model from {settings.MODEL_PATH}...")
+    def __init__(self, device=None):
+        self.device = device or settings.DEVICE
+        print(f"Loading model from {settings.MODEL_PATH} ({self.device})...")
+        configure_cpu_threads()
         self.tokenizer = AutoTokenizer.from_pretrained(settings.MODEL_PATH)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            settings.MODEL_PATH, 
-            torch_dtype="auto", 
-            device_map=settings.DEVICE
-        ).eval()
+        self.model = MODEL_BACKENDS.get(self.device, _load_reference)(settings.MODEL_PATH, self.device)
+        self.scoring_mode = settings.SCORING_MODE
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
         self.id2risk = self.tokenizer.init_kwargs.get('id2risk', {})
+        self._build_risk_index()
+        self.prefix_cache = KVPrefixCache(
+            int(settings.PREFIX_CACHE_MAX_MB * 1024 * 1024), settings.PREFIX_CACHE_MIN_TOKENS
+        )
+        self._turn_tail_tokens = self._measure_turn_tail()
+        self.context = ContextPolicy(
+            self.tokenizer, self.render, settings.GUARD_MAX_TOKENS,
+            settings.GUARD_WINDOW_OVERLAP_TOKENS, settings.GUARD_TOKEN_COUNT_CACHE_SIZE
+        )
         print("Model loaded successfully.")
 
+    def _build_risk_index(self):
+        # Every vocab entry that decodes (stripped) to a risk code, e.g. "dw" and " dw",
+        # mapped to that code's column. Built once so scoring is a single gather.
+        self.categories = list(RISK_CODES) + [k for k in self.id2risk if k not in RISK_CODES]
+        column = {code: idx for idx, code in enumerate(self.categories)}
+        vocab_size = len(self.tokenizer)
+        decoded = self.tokenizer.batch_decode([[token_id] for token_id in range(vocab_size)])
+        token_ids, token_columns = [], []
+        for token_id, token_str in enumerate(decoded):
+            idx = column.get(token_str.strip())
+            if idx is not None:
+                token_ids.append(token_id)
+                token_columns.append(idx)
+        self.risk_token_ids = torch.tensor(token_ids, dtype=torch.long, device=self.model.device)
+        self.risk_token_columns = torch.tensor(token_columns, dtype=torch.long, device=self.model.device)
+
+    def _measure_turn_tail(self):
+        # Tokens the chat template appends after an assistant message (e.g. "<|im_end|>\n").
+        # A partial reply rendered now is a prefix of the longer reply rendered later
+        # only up to that tail, so stored KV is also indexed at that point.
+        marker = "<<tail>>"
+        try:
+            probe = self.render([{"role": "user", "content": "?"}, {"role": "assistant", "content": marker}], check_response=True)
+        except Exception:
+            return 0
+        tail = probe[probe.rindex(marker) + len(marker):]
+        return len(self.tokenizer(tail, add_special_tokens=False)["input_ids"]) + 1
+
+    def warmup(self, seq_lens, batch_sizes):
+        """
+        Scores throwaway batches at roughly the given token lengths so kernel
+        selection and allocator growth happen before the first real check.
+        """
+        overhead = len(self.tokenizer(self.render([{"role": "user", "content": ""}]))["input_ids"])
+        for seq_len in seq_lens:
+            query = self.render([{"role": "user", "content": " hello" * max(1, seq_len - overhead)}])
+            for batch_size in batch_sizes:
+                self.infer_batch([query] * batch_size)
+        # Don't let warmup entries or counters show up in prefix reuse stats
+        self.prefix_cache = KVPrefixCache(self.prefix_cache.max_bytes, self.prefix_cache.min_prefix_tokens)
+
+    def render(self, messages, check_response=False):
+        """
+        Renders a conversation into the guard model's chat template.
+        If check_response is True, the messages list should include the assistant's response.
+        """
+        with metrics.span("guard_template"):
+            return self.tokenizer.apply_chat_template(
+                messages, 
+                tokenize=False, 
+                add_generation_prompt=not check_response
+            )
+
     def infer(self, messages, check_response=False, max_new_tokens=1):
         """
         Executes model inference to detect risks.
         If check_response is True, the messages list should include the assistant's response.
         """
-        rendered_query = self.tokenizer.apply_chat_template(
-            messages, 
-            tokenize=False, 
-            add_generation_prompt=not check_response
+        return self.infer_batch([self.render(messages, check_response)], max_new_tokens=max_new_tokens)[0]
+
+    def infer_batch(self, rendered_queries, max_new_tokens=1):
+        """
+        Scores several rendered conversations in one padded model call.
+        Returns one risk map per query, in the same order.
+        """
+        if self.scoring_mode == "generate":
+            return self._infer_generate(rendered_queries, max_new_tokens)
+        return self._infer_forward(rendered_queries)
+
+    def _infer_forward(self, rendered_queries):
+        if self.prefix_cache.enabled:
+            return self._infer_forward_reusing_prefix(rendered_queries)
+
+        # Right padding keeps position ids natural; each row is read at its own last token
+        with metrics.span("guard_tokenize"):
+            model_inputs = self.tokenizer(
+                rendered_queries, return_tensors="pt", padding=True, padding_side="right"
+            ).to(self.model.device)
+        last_positions = model_inputs["attention_mask"].sum(dim=1) - 1
+
+        with torch.no_grad(), metrics.span("guard_forward"):
+            # Run the decoder only and project just the last positions, so the
+            # [batch, seq, vocab] logits tensor is never materialised.
+            hidden = self.model.base_model(**model_inputs).last_hidden_state
+            last_hidden = hidden[torch.arange(hidden.shape[0], device=hidden.device), last_positions]
+            return self._risk_maps_from_hidden(last_hidden)
+
+    def _infer_forward_reusing_prefix(self, rendered_queries):
+        with metrics.span("guard_tokenize"):
+            encoded = self.tokenizer(rendered_queries)["input_ids"]
+        last_hidden = [None] * len(encoded)
+        misses = []
+
+        with torch.no_grad(), metrics.span("guard_forward"):
+            for idx, token_ids in enumerate(encoded):
+                # Leave at least one token to prefill so there is a position to read
+                found = self.prefix_cache.lookup(token_ids, len(token_ids) - 1)
+                if found is None:
+                    misses.append(idx)
+                    continue
+                kv_layers, prefix_length = found
+                last_hidden[idx] = self._extend_prefix(token_ids, kv_layers, prefix_length)
+
+            if misses:
+                for idx, hidden in zip(misses, self._prefill_batch([encoded[idx] for idx in misses])):
+                    last_hidden[idx] = hidden
+
+            return self._risk_maps_from_hidden(torch.stack(last_hidden))
+
+    def _extend_prefix(self, token_ids, kv_layers, prefix_length):
+        past = DynamicCache()
+        for layer_idx, (keys, values) in enumerate(kv_layers):
+            past.update(keys[:, :, :prefix_length].clone(), values[:, :, :prefix_length].clone(), layer_idx)
+        device = self.model.device
+        outputs = self.model.base_model(
+            input_ids=torch.tensor([token_ids[prefix_length:]], device=device),
+            attention_mask=torch.ones(1, len(token_ids), dtype=torch.long, device=device),
+            past_key_values=past,
+            use_cache=True,
         )
+        self.prefix_cache.reused_tokens += prefix_length
+        self.prefix_cache.prefilled_tokens += len(token_ids) - prefix_length
+        self._remember(token_ids, _kv_layers(outputs.past_key_values))
+        return outputs.last_hidden_state[0, -1]
+
+    def _prefill_batch(self, batch_ids):
+        lengths = [len(token_ids) for token_ids in batch_ids]
+        width = max(lengths)
+        pad_id = self.tokenizer.pad_token_id
+        device = self.model.device
+        input_ids = torch.tensor([ids + [pad_id] * (width - len(ids)) for ids in batch_ids], device=device)
+        attention_mask = torch.tensor([[1] * n + [0] * (width - n) for n in lengths], device=device)
+
+        outputs = self.model.base_model(input_ids=input_ids, attention_mask=attention_mask, use_cache=True)
+        batch_layers = _kv_layers(outputs.past_key_values)
+        last_hidden = []
+        for row, (token_ids, n) in enumerate(zip(batch_ids, lengths)):
+            last_hidden.append(outputs.last_hidden_state[row, n - 1])
+            self.prefix_cache.prefilled_tokens += n
+            # Right padding: the row's own KV is exactly its first n positions
+            self._remember(token_ids, [
+                (keys[row:row + 1, :, :n].clone(), values[row:row + 1, :, :n].clone())
+                for keys, values in batch_layers
+            ])
+        return last_hidden
+
+    def _remember(self, token_ids, kv_layers):
+        nbytes = sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in kv_layers)
+        n = len(token_ids)
+        self.prefix_cache.store(token_ids, kv_layers, [n, n - self._turn_tail_tokens], nbytes)
+
+    def _risk_maps_from_hidden(self, last_hidden):
+        logits = self.model.get_output_embeddings()(last_hidden).float()
+        return self._risk_maps_from_probs(logits.softmax(-1))
+
+    def _risk_maps_from_probs(self, probs):
+        # Per category, keep the best-scoring token among its vocab variants
+        token_probs = probs[:, self.risk_token_ids]
+        category_probs = torch.zeros(probs.shape[0], len(self.categories), device=probs.device)
+        category_probs.scatter_reduce_(
+            1, self.risk_token_columns.expand_as(token_probs), token_probs, reduce="amax"
+        )
+
+        risk_maps = []
+        for row in category_probs.tolist():
+            ranked = sorted(zip(self.categories, row), key=lambda item: item[1], reverse=True)
+            risk_maps.append(dict(ranked))
+        return risk_maps
+
+    def _infer_generate(self, rendered_queries, max_new_tokens=1):
+        # Reference path: batched generate needs left padding so every row's next token lines up
+        with metrics.span("guard_tokenize"):
+            model_inputs = self.tokenizer(
+                rendered_queries, return_tensors="pt", padding=True, padding_side="left"
+            ).to(self.model.device)
         
-        model_inputs = self.tokenizer([rendered_query], return_tensors="pt").to(self.model.device)
-        
-        with torch.no_grad():
+        with torch.no_grad(), metrics.span("guard_forward"):
             outputs = self.model.generate(
                 **model_inputs, 
                 max_new_tokens=max_new_tokens, 
                 do_sample=False, 
                 output_scores=True, 
-                return_dict_in_generate=True
+                return_dict_in_generate=True,
+                pad_token_id=self.tokenizer.pad_token_id
             )
 
-        input_length = model_inputs['input_ids'].shape[1]
-        
         # Parse output for risk scores
         # The first generated token usually contains the risk classification
         # We look at the scores for the first generated token
@@ -49,15 +260,15 @@ class SafetyEngine:
         # In this model's specific architecture for 0.6B:
         # It generates structured output. We need to look at the probability of risk tokens.
         
-        first_token_scores = scores[0, 0, :] # Batch 0, Step 0
-        
+        return [self._risk_map_topk(scores[row, 0, :]) for row in range(scores.shape[0])]
+
+    def _risk_map_topk(self, first_token_scores):
         risk_score_map = {}
         
         # Iterate over all tokens in vocab is too slow, we should look at top k or specific tokens
         # The README example logic is a bit complex, iterating topk. Let's adapt it.
         
         values, indices = first_token_scores.topk(k=20)
-        print(f"Top 5 tokens: {[self.tokenizer.decode([i]).strip() + f'({v.item():.4f})' for v, i in zip(values[:5], indices[:5])]}")
         
         for v, i in zip(values, indices):
             token_id = i.item()
@@ -81,10 +292,14 @@ class SafetyEngine:
 
             if token_str in self.id2risk:
                 risk_score_map[token_str] = score
-            elif token_str in ['dw', 'pc', 'dc', 'pi', 'ec', 'ac', 'def', 'ti', 'cy', 'ph', 'mh', 'se', 'sci', 'pp', 'cs', 'acc', 'mc', 'ha', 'ps', 'ter', 'sd', 'ext', 'fin', 'med', 'law', 'cm', 'ma', 'md', 'sec']:
+            elif token_str in RISK_CODES:
                  # Fallback if id2risk is empty or doesn't have it
                  risk_score_map[token_str] = score
 
         return risk_score_map
 
-safety_engine = SafetyEngine()
+def _kv_layers(cache):
+    # Per-layer (keys, values) tensors across transformers cache layouts
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
@@ -0,0 +1,67 @@
+from json.decoder import scanstring
+
+
+class SSEDeltaParser:
+    """
+    Incremental parser for OpenAI-style chat completion streams.
+
+    feed() takes raw upstream bytes and returns the complete events they finish
+    (still as bytes, so they can be relayed unchanged) together with the delta
+    texts of choice 0. Only the "content" string is decoded; the rest of each
+    event is never parsed.
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self.events = 0
+        self.done = False
+
+    def feed(self, data: bytes):
+        # Returns (event_bytes, deltas); bytes after the last event boundary stay buffered
+        buffer = self._buffer + data if self._buffer else data
+        lf, crlf = buffer.rfind(b"\n\n"), buffer.rfind(b"\r\n\r\n")
+        end = max(lf + 2 if lf >= 0 else 0, crlf + 4 if crlf >= 0 else 0)
+        if not end:
+            self._buffer = buffer
+            return b"", []
+        events, self._buffer = buffer[:end], buffer[end:]
+        return events, self._deltas(events)
+
+    def flush(self):
+        # Whatever the upstream sent after its last complete event
+        events, self._buffer = self._buffer, b""
+        return events, self._deltas(events)
+
+    def _deltas(self, events: bytes):
+        deltas = []
+        for line in events.split(b"\n"):
+            if not line.startswith(b"data:"):
+                continue
+            self.events += 1
+            text = self._delta(line[5:].strip())
+            if text:
+                deltas.append(text)
+        return deltas
+
+    def _delta(self, payload: bytes):
+        if payload == b"[DONE]":
+            self.done = True
+            return None
+        start = payload.find(b'"delta"')
+        if start < 0:
+            return None
+        key = payload.find(b'"content"', start)
+        following = payload.find(b'"delta"', start + 7)
+        if key < 0 or 0 <= following < key:
+            return None  # no text in choice 0 (a later choice's delta does not count)
+        # A JSON-escaped '"content"' inside another string value ends in '\"', so it never matches
+        pos = key + 9
+        while payload[pos:pos + 1] in (b" ", b":"):
+            pos += 1
+        if payload[pos:pos + 1] != b'"':
+            return None  # null content (role or tool-call deltas)
+        try:
+            text = payload[pos + 1:].decode("utf-8")
+            return scanstring(text, 0)[0]
+        except ValueError:
+            return None
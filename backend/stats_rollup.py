@@ -0,0 +1,252 @@
+"""
+Pre-aggregated audit statistics.
+
+Every batch the audit writer inserts is also folded into StatsRollup rows, in
+the same transaction: request/block counts, latency sums and latency histogram
+buckets per minute, per hour and all-time, for all traffic and per blocking
+category. /api/stats reads only these rows, so its cost depends on the queried
+time range, not on the size of the audit log.
+"""
+import bisect
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import bindparam, delete, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, func, select
+
+from config import settings
+from models import AuditLog, StatsRollup
+
+try:
+    import fcntl
+except ImportError:  # Windows: run a single worker, nothing to coordinate
+    fcntl = None
+
+# Upper bounds of the latency histogram buckets
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+GRANULARITIES = ("minute", "hour", "total")
+TOTAL_BUCKET = datetime(1970, 1, 1)
+# Ranges up to this long are answered from minute buckets, longer ones from hour buckets
+MINUTE_RANGE_LIMIT = timedelta(hours=6)
+# Audit actions that count as blocked: policy verdicts only, not client disconnects
+# or fail-closed cuts while the guard was unavailable
+BLOCK_ACTIONS = ("block_prompt", "block_response", "block_response_stream")
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    if granularity == "minute":
+        return timestamp.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return TOTAL_BUCKET
+
+
+def latency_bucket(latency_ms: float) -> float:
+    return LATENCY_BUCKETS_MS[min(bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms), len(LATENCY_BUCKETS_MS) - 1)]
+
+
+def rollup_deltas(rows) -> dict:
+    # (granularity, bucket, category, latency bucket) -> [requests, blocked, latency_ms_sum]
+    deltas = defaultdict(lambda: [0, 0, 0.0])
+    for row in rows:
+        latency = row["latency_ms"] or 0.0
+        le = latency_bucket(latency)
+        blocked = row["action"] in BLOCK_ACTIONS
+        category = row.get("blocked_category") if blocked else None
+        for granularity in GRANULARITIES:
+            bucket = bucket_start(row["timestamp"], granularity)
+            for key in ("", category) if category else ("",):
+                delta = deltas[(granularity, bucket, key, le)]
+                delta[0] += 1
+                delta[1] += blocked
+                delta[2] += latency
+    return deltas
+
+
+def apply_rollups(session: Session, rows):
+    # Upserts the batch's counters; runs inside the caller's transaction
+    deltas = rollup_deltas(rows)
+    if not deltas:
+        return
+    table = StatsRollup.__table__
+    statement = sqlite_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=["granularity", "bucket", "category", "latency_le_ms"],
+        set_={
+            "requests": table.c.requests + statement.excluded.requests,
+            "blocked": table.c.blocked + statement.excluded.blocked,
+            "latency_ms_sum": table.c.latency_ms_sum + statement.excluded.latency_ms_sum,
+        },
+    )
+    session.execute(statement, [
+        {
+            "granularity": granularity, "bucket": bucket, "category": category, "latency_le_ms": le,
+            "requests": requests, "blocked": blocked, "latency_ms_sum": latency_sum,
+        }
+        for (granularity, bucket, category, le), (requests, blocked, latency_sum) in deltas.items()
+    ])
+
+
+def prune_rollups(session: Session, retention_hours: int) -> int:
+    cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+    result = session.execute(
+        delete(StatsRollup).where(StatsRollup.granularity == "minute", StatsRollup.bucket < cutoff)
+    )
+    return result.rowcount
+
+
+def _blocked_category(risk_score, risk_details):
+    # Older rows only kept the score of the blocking category; find it in the risk map
+    try:
+        risk_map = json.loads(risk_details or "{}")
+    except ValueError:
+        return None
+    matches = [code for code, score in risk_map.items() if not code.startswith("_") and score == risk_score]
+    return matches[0] if matches else None
+
+
+def backfill_rollups(session: Session, chunk_size: int = 5000) -> int:
+    """
+    Builds the rollups from an audit log written before they existed, filling in
+    blocked_category on the way. Runs once, while the rollup table is still empty;
+    every worker calls it at startup, so they take turns on a lock file next to
+    the database and all but the first find the rollups already built.
+    """
+    database = session.get_bind().url.database
+    if fcntl is None or not database or database == ":memory:":
+        return _backfill_rollups(session, chunk_size)
+    with open(f"{database}.backfill.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return _backfill_rollups(session, chunk_size)
+
+
+def _backfill_rollups(session: Session, chunk_size: int) -> int:
+    if session.exec(select(StatsRollup.id).limit(1)).first() is not None:
+        return 0
+    columns = (AuditLog.id, AuditLog.timestamp, AuditLog.action, AuditLog.latency_ms,
+               AuditLog.risk_score, AuditLog.risk_details, AuditLog.blocked_category)
+    last_id = 0
+    total = 0
+    while True:
+        chunk = session.exec(select(*columns).where(AuditLog.id > last_id).order_by(AuditLog.id).limit(chunk_size)).all()
+        if not chunk:
+            break
+        rows, categories = [], []
+        for row_id, timestamp, action, latency_ms, risk_score, risk_details, category in chunk:
+            if action in BLOCK_ACTIONS and category is None:
+                category = _blocked_category(risk_score, risk_details)
+                if category is not None:
+                    categories.append({"row_id": row_id, "category": category})
+            rows.append({"timestamp": timestamp, "action": action, "latency_ms": latency_ms, "blocked_category": category})
+        if categories:
+            session.execute(
+                update(AuditLog.__table__).where(AuditLog.__table__.c.id == bindparam("row_id"))
+                .values(blocked_category=bindparam("category")),
+                categories,
+            )
+        apply_rollups(session, rows)
+        last_id = chunk[-1][0]
+        total += len(chunk)
+    session.commit()
+    return total
+
+
+def naive_utc(value: datetime):
+    # Audit timestamps are naive UTC; convert aware query parameters to match
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _percentile(histogram, requests, p):
+    # Upper bound of the bucket holding the p-th percentile (None past the last finite bound)
+    if not requests:
+        return 0.0
+    seen = 0
+    for le, count in histogram:
+        seen += count
+        if seen >= p / 100 * requests:
+            break
+    return None if le == float("inf") else le
+
+
+def query_stats(session: Session, since: datetime = None, until: datetime = None, category: str = None,
+                granularity: str = None) -> dict:
+    """
+    Request/block counts, per-category blocks and the latency histogram for a
+    time range (all-time when neither since nor until is given), answered from
+    the rollups at bucket resolution. With category, latency and series cover
+    only requests blocked in that category.
+    """
+    if granularity is not None and granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {GRANULARITIES}")
+    since, until = naive_utc(since), naive_utc(until)
+    if granularity is None and since is None and until is None:
+        granularity = "total"
+    elif granularity is None:
+        now = datetime.utcnow()
+        span = (until or now) - (since or TOTAL_BUCKET)
+        retained = since is not None and since >= now - timedelta(hours=settings.STATS_MINUTE_RETENTION_HOURS)
+        granularity = "minute" if span <= MINUTE_RANGE_LIMIT and retained else "hour"
+
+    scope = [StatsRollup.granularity == granularity]
+    if granularity != "total":
+        if since is not None:
+            scope.append(StatsRollup.bucket >= bucket_start(since, granularity))
+        if until is not None:
+            scope.append(StatsRollup.bucket <= until)
+
+    requests, blocked = session.exec(
+        select(func.coalesce(func.sum(StatsRollup.requests), 0), func.coalesce(func.sum(StatsRollup.blocked), 0))
+        .where(*scope, StatsRollup.category == "")
+    ).one()
+    categories = dict(session.exec(
+        select(StatsRollup.category, func.sum(StatsRollup.blocked))
+        .where(*scope, StatsRollup.category != "")
+        .group_by(StatsRollup.category)
+        .order_by(func.sum(StatsRollup.blocked).desc())
+    ).all())
+
+    selected = StatsRollup.category == (category or "")
+    histogram_rows = session.exec(
+        select(StatsRollup.latency_le_ms, func.sum(StatsRollup.requests), func.sum(StatsRollup.latency_ms_sum))
+        .where(*scope, selected)
+        .group_by(StatsRollup.latency_le_ms)
+        .order_by(StatsRollup.latency_le_ms)
+    ).all()
+    histogram = [(le, count) for le, count, _ in histogram_rows]
+    selected_requests = sum(count for _, count in histogram)
+    latency_sum = sum(total for _, _, total in histogram_rows)
+
+    stats = {
+        "total_requests": requests,
+        "blocked_requests": blocked,
+        "block_rate": (blocked / requests) if requests > 0 else 0,
+        "granularity": granularity,
+        "since": since,
+        "until": until,
+        "categories": categories,
+        "latency": {
+            "mean_ms": (latency_sum / selected_requests) if selected_requests else 0.0,
+            "p50_ms": _percentile(histogram, selected_requests, 50),
+            "p95_ms": _percentile(histogram, selected_requests, 95),
+            "p99_ms": _percentile(histogram, selected_requests, 99),
+            "histogram": [{"le": "+Inf" if le == float("inf") else le, "count": count} for le, count in histogram],
+        },
+    }
+    if category is not None:
+        stats["category"] = category
+        stats["category_blocked"] = categories.get(category, 0)
+    if granularity != "total":
+        stats["series"] = [
+            {"bucket": bucket, "requests": bucket_requests, "blocked": bucket_blocked}
+            for bucket, bucket_requests, bucket_blocked in session.exec(
+                select(StatsRollup.bucket, func.sum(StatsRollup.requests), func.sum(StatsRollup.blocked))
+                .where(*scope, selected)
+                .group_by(StatsRollup.bucket)
+                .order_by(StatsRollup.bucket)
+            ).all()
+        ]
+    return stats
@@ -0,0 +1,25 @@
+import asyncio
+
+from sqlmodel import Session, SQLModel, func, select
+
+from audit_writer import AuditWriter, audit_row
+from database import make_engine
+from models import AuditLog
+
+
+def test_submit_after_stop_is_written_without_restarting(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'gateway.db'}")
+    SQLModel.metadata.create_all(engine)
+    writer = AuditWriter(engine, max_queue=16, batch_size=8, flush_interval_ms=1000, overflow="block")
+
+    async def scenario():
+        writer.start()
+        await writer.submit(audit_row("before stop", None, 0.0, {}, "allow", 1.0))
+        await writer.stop()
+        await writer.submit(audit_row("after stop", None, 0.0, {}, "allow", 1.0))
+        assert writer._worker is None
+
+    asyncio.run(scenario())
+    with Session(engine) as session:
+        assert session.exec(select(func.count()).select_from(AuditLog)).one() == 2
+    assert writer.stats()["written"] == 2
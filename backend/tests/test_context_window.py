@@ -0,0 +1,87 @@
+from context_window import ContextPolicy
+
+
+class _WordTokenizer:
+    """One token per whitespace-separated word."""
+
+    def __call__(self, text, add_special_tokens=True):
+        return {"input_ids": text.split()}
+
+    def decode(self, ids):
+        return " ".join(ids)
+
+
+def _render(messages):
+    return "".join(f"<im_start> {m['role']} {m['content']} <im_end> " for m in messages)
+
+
+def _words(prefix, n):
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+
+def _policy(max_tokens):
+    return ContextPolicy(_WordTokenizer(), _render, max_tokens, overlap_tokens=10, count_cache_size=128)
+
+
+def test_response_check_keeps_tail_of_long_user_prompt():
+    messages = [
+        {"role": "system", "content": _words("s", 5)},
+        {"role": "user", "content": _words("u", 400)},
+        {"role": "assistant", "content": _words("a", 20)},
+    ]
+    conversations, decision = _policy(100).plan(messages)
+
+    assert len(conversations) == 1
+    kept = conversations[0]
+    assert [m["role"] for m in kept] == ["system", "user", "assistant"]
+    assert kept[-1] == messages[-1]
+    assert messages[1]["content"].endswith(kept[1]["content"])
+    assert kept[1]["content"].endswith("u399")
+    assert decision["dropped_messages"] == 0
+    assert decision["user_turn_tokens"] == len(kept[1]["content"].split())
+
+
+def test_windowed_reply_carries_user_tail_in_every_window():
+    messages = [
+        {"role": "user", "content": _words("u", 400)},
+        {"role": "assistant", "content": _words("a", 500)},
+    ]
+    conversations, decision = _policy(100).plan(messages)
+
+    assert len(conversations) == decision["windows"] > 1
+    for kept in conversations:
+        assert [m["role"] for m in kept] == ["user", "assistant"]
+        assert kept[0]["content"].endswith("u399")
+    assert conversations[-1][-1]["content"].endswith("a499")
+
+
+def test_prompt_check_still_drops_oldest_turns():
+    messages = [
+        {"role": "user", "content": _words("old", 200)},
+        {"role": "assistant", "content": _words("reply", 20)},
+        {"role": "user", "content": _words("new", 20)},
+    ]
+    conversations, decision = _policy(60).plan(messages)
+
+    assert conversations == [messages[1:]]
+    assert decision["dropped_messages"] == 1
+    assert "user_turn_tokens" not in decision
+
+
+def test_oversized_system_prompt_is_windowed_not_dropped():
+    messages = [
+        {"role": "system", "content": _words("s", 300)},
+        {"role": "user", "content": _words("u", 20)},
+    ]
+    policy = _policy(100)
+    conversations, decision = policy.plan(messages)
+
+    assert decision["system_windows"] == len(conversations) > 1
+    seen = set()
+    for kept in conversations:
+        assert [m["role"] for m in kept] == ["system", "user"]
+        assert kept[-1] == messages[-1]
+        assert len(_render(kept).split()) <= 100
+        seen.update(kept[0]["content"].split())
+    assert seen == set(messages[0]["content"].split())
+    assert conversations[0][0]["content"].endswith("s299")
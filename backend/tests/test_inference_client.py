@@ -0,0 +1,39 @@
+import asyncio
+import struct
+
+import pytest
+
+from batcher import GuardUnavailable
+from inference_client import _Connection
+
+
+class _Writer:
+    def __init__(self):
+        self.closed = False
+
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize("body", [b"{not json", b'["no", "id"]'])
+def test_bad_frame_fails_pending_requests(body):
+    async def scenario():
+        reader = asyncio.StreamReader()
+        conn = _Connection(reader, _Writer())
+        pending = asyncio.create_task(conn.request(1, {"op": "infer"}))
+        await asyncio.sleep(0)
+        reader.feed_data(struct.pack(">I", len(body)) + body)
+        with pytest.raises(GuardUnavailable):
+            await asyncio.wait_for(pending, 1)
+        assert not conn.alive
+        assert conn.writer.closed
+        with pytest.raises(GuardUnavailable):
+            await conn.request(2, {"op": "infer"})
+
+    asyncio.run(scenario())
@@ -0,0 +1,20 @@
+import asyncio
+
+import pytest
+
+import inference_server
+from batcher import GuardOverloaded, GuardUnavailable
+
+
+@pytest.mark.parametrize("error, overloaded", [
+    (GuardUnavailable("Guard model is still loading", retry_after=5), False),
+    (GuardOverloaded("Guard queue is full (8 checks pending)", 2), True),
+])
+def test_score_reports_overload_only_for_a_full_queue(monkeypatch, error, overloaded):
+    async def infer(messages, check_response=False):
+        raise error
+
+    monkeypatch.setattr(inference_server.batcher, "infer", infer)
+    response = asyncio.run(inference_server.handle_request({"op": "score", "messages": []}))
+    assert response["overloaded"] is overloaded
+    assert response["retry_after"] == error.retry_after
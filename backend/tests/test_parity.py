@@ -0,0 +1,15 @@
+import argparse
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+
+def test_forward_scorer_matches_generate_on_tiny_model(monkeypatch):
+    from benchmarks import parity, tiny_model
+    from config import settings
+
+    monkeypatch.setattr(settings, "MODEL_PATH", tiny_model.ensure())
+    monkeypatch.setattr(settings, "DEVICE", "cpu")
+    assert parity.check_scoring_modes(argparse.Namespace(tolerance=1e-4, batch_size=8)) == 0
@@ -0,0 +1,71 @@
+import threading
+from datetime import datetime
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+
+import models  # noqa: F401  registers the tables
+from database import make_engine
+from stats_rollup import apply_rollups, backfill_rollups, query_stats
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def test_unknown_granularity_is_rejected_without_a_range(session):
+    with pytest.raises(ValueError):
+        query_stats(session, granularity="bogus")
+
+
+def test_granularity_defaults_to_total_only_when_omitted(session):
+    assert query_stats(session)["granularity"] == "total"
+    assert query_stats(session, granularity="hour")["granularity"] == "hour"
+
+
+def test_only_policy_blocks_count_as_blocked(session):
+    now = datetime.utcnow()
+    apply_rollups(session, [
+        {"timestamp": now, "action": "client_disconnect", "latency_ms": 40.0, "blocked_category": None},
+        {"timestamp": now, "action": "guard_unavailable", "latency_ms": 50.0, "blocked_category": None},
+        {"timestamp": now, "action": "block_response_stream", "latency_ms": 60.0, "blocked_category": "S1"},
+    ])
+    session.commit()
+    stats = query_stats(session)
+    assert stats["total_requests"] == 3
+    assert stats["blocked_requests"] == 1
+    assert stats["categories"] == {"S1": 1}
+
+
+def test_concurrent_backfills_count_each_row_once(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'gateway.db'}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all(models.AuditLog(user_input=f"prompt {i}", action="allow", latency_ms=5.0) for i in range(2000))
+        session.commit()
+
+    # Every worker runs the backfill at startup
+    errors = []
+    start = threading.Barrier(4)
+
+    def worker():
+        try:
+            with Session(engine) as session:
+                start.wait()
+                backfill_rollups(session, chunk_size=100)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    with Session(engine) as session:
+        assert query_stats(session)["total_requests"] == 2000
@@ -0,0 +1,37 @@
+import asyncio
+
+from upstream import UpstreamBackend, UpstreamPool
+
+
+class _HangingClient:
+    """Stands in for httpx.AsyncClient; send() waits until cancelled."""
+
+    def __init__(self):
+        self.sending = asyncio.Event()
+
+    def build_request(self, method, url, headers=None, json=None):
+        return (method, url)
+
+    async def send(self, request, stream=False):
+        self.sending.set()
+        await asyncio.Event().wait()
+
+
+def test_cancelled_send_releases_outstanding_slot():
+    async def scenario():
+        backend = UpstreamBackend("http://upstream.invalid/v1", "key")
+        pool = UpstreamPool([backend])
+        pool.client = _HangingClient()
+        task = asyncio.create_task(pool._send({"model": "m"}, stream=True))
+        await pool.client.sending.wait()
+        assert backend.outstanding == 1
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return backend
+
+    backend = asyncio.run(scenario())
+    assert backend.outstanding == 0
+    assert backend.errors == 0
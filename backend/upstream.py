@@ -0,0 +1,200 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import httpx
+
+from config import settings
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class UpstreamBackend:
+    def __init__(self, api_base: str, api_key: str, model: str = None):
+        self.api_base = api_base.rstrip("/")
+        self.api_key = api_key
+        self.model = model
+
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+        self.latency_ewma_ms = None
+        self.latencies_ms = deque(maxlen=512)
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def record_success(self, latency_ms: float):
+        self.consecutive_failures = 0
+        self.latencies_ms.append(latency_ms)
+        if self.latency_ewma_ms is None:
+            self.latency_ewma_ms = latency_ms
+        else:
+            self.latency_ewma_ms = 0.8 * self.latency_ewma_ms + 0.2 * latency_ms
+
+    def record_failure(self):
+        self.errors += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= settings.UPSTREAM_EJECT_AFTER_FAILURES:
+            # Take the backend out of rotation for a while; it is retried once the window passes
+            self.ejected_until = time.monotonic() + settings.UPSTREAM_EJECT_SECONDS
+            self.consecutive_failures = 0
+            self.ejections += 1
+            print(f"Upstream {self.api_base} ejected for {settings.UPSTREAM_EJECT_SECONDS}s")
+
+    def stats(self) -> dict:
+        ordered = sorted(self.latencies_ms)
+
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else None
+
+        return {
+            "api_base": self.api_base,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejections": self.ejections,
+            "latency_ewma_ms": self.latency_ewma_ms,
+            "latency_p50_ms": percentile(0.50),
+            "latency_p95_ms": percentile(0.95),
+        }
+
+
+class UpstreamPool:
+    """
+    One long-lived HTTP connection pool shared by every upstream call, spread over
+    one or more OpenAI-compatible backends with least-outstanding-requests balancing,
+    retries with exponential backoff and temporary ejection of failing backends.
+    """
+
+    def __init__(self, backends):
+        self.backends = backends
+        self.client = None
+        self.http2 = False
+
+    async def start(self):
+        if self.client is not None:
+            return
+        http2 = settings.UPSTREAM_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("WARNING: UPSTREAM_HTTP2 needs the 'h2' package (pip install httpx[http2]); using HTTP/1.1")
+                http2 = False
+        self.http2 = http2
+        self.client = httpx.AsyncClient(
+            http2=http2,
+            timeout=settings.UPSTREAM_TIMEOUT_S,
+            limits=httpx.Limits(
+                max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE,
+                keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY_S,
+            ),
+        )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def pick(self, exclude=()) -> UpstreamBackend:
+        candidates = [b for b in self.backends if b.healthy and b not in exclude]
+        if not candidates:
+            # Everything is ejected or already tried: fall back to whoever recovers first
+            candidates = [b for b in self.backends if b not in exclude] or self.backends
+            return min(candidates, key=lambda b: b.ejected_until)
+        return min(candidates, key=lambda b: (b.outstanding, b.latency_ewma_ms or 0.0))
+
+    def _request(self, backend: UpstreamBackend, payload: dict):
+        if backend.model:
+            payload = {**payload, "model": backend.model}
+        return self.client.build_request(
+            "POST",
+            f"{backend.api_base}/chat/completions",
+            headers={"Authorization": f"Bearer {backend.api_key}"},
+            json=payload,
+        )
+
+    async def _send(self, payload: dict, stream: bool):
+        # Returns (backend, response); retries only happen before any body is consumed
+        await self.start()
+        tried = []
+        last_error = None
+        for attempt in range(settings.UPSTREAM_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(settings.UPSTREAM_RETRY_BACKOFF_MS / 1000 * (2 ** (attempt - 1)))
+            backend = self.pick(exclude=tried)
+            tried.append(backend)
+            backend.requests += 1
+            backend.outstanding += 1
+            started = time.perf_counter()
+            try:
+                response = await self.client.send(self._request(backend, payload), stream=stream)
+            except httpx.HTTPError as e:
+                backend.outstanding -= 1
+                backend.record_failure()
+                last_error = e
+                continue
+            except BaseException:
+                # Cancelled mid-send (speculative dispatch dropped, client gone): give the slot back
+                backend.outstanding -= 1
+                raise
+            if response.status_code in RETRYABLE_STATUS:
+                try:
+                    await response.aclose()
+                finally:
+                    backend.outstanding -= 1
+                backend.record_failure()
+                last_error = UpstreamError(f"{backend.api_base} returned {response.status_code}")
+                continue
+            # For streams this is time to response headers
+            backend.record_success((time.perf_counter() - started) * 1000)
+            return backend, response
+        raise last_error or UpstreamError("No upstream backend available")
+
+    async def post_json(self, payload: dict) -> dict:
+        backend, response = await self._send(payload, stream=False)
+        try:
+            response.raise_for_status()
+            return response.json()
+        finally:
+            backend.outstanding -= 1
+
+    @asynccontextmanager
+    async def stream(self, payload: dict):
+        backend, response = await self._send(payload, stream=True)
+        try:
+            response.raise_for_status()
+            yield response
+        finally:
+            backend.outstanding -= 1
+            await response.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "http2": self.http2,
+            "backends": [b.stats() for b in self.backends],
+        }
+
+
+def _configured_backends():
+    if settings.UPSTREAM_BACKENDS:
+        return [
+            UpstreamBackend(b["api_base"], b.get("api_key", settings.UPSTREAM_API_KEY), b.get("model"))
+            for b in settings.UPSTREAM_BACKENDS
+        ]
+    return [UpstreamBackend(settings.UPSTREAM_API_BASE, settings.UPSTREAM_API_KEY)]
+
+
+upstream_pool = UpstreamPool(_configured_backends())
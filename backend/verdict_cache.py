@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+from config import settings
+
+
+class VerdictCache:
+    """
+    Bounded LRU + TTL cache of raw risk maps.
+    Only model output is cached; SecurityPolicy thresholds are still applied by the
+    caller on every request, so policy edits take effect immediately. Identical
+    checks that arrive while one is already running share that single inference.
+    """
+
+    def __init__(self, max_entries: int, ttl_s: float):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_s > 0
+
+    @staticmethod
+    def key(conversation: str, direction: str) -> str:
+        return hashlib.sha256(f"{direction}\0{conversation}".encode("utf-8")).hexdigest()
+
+    async def get_or_compute(self, key: str, compute) -> dict:
+        if not self.enabled:
+            return await compute()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, risk_map = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(risk_map)
+            del self._entries[key]
+            self.expirations += 1
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._settle(key, t))
+
+        # Shield so one caller going away does not cancel the shared inference
+        return dict(await asyncio.shield(task))
+
+    def _settle(self, key, task):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_s, task.result())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def flush(self) -> int:
+        flushed = len(self._entries)
+        self._entries.clear()
+        return flushed
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": ((self.hits + self.coalesced) / lookups) if lookups > 0 else 0,
+        }
+
+
+verdict_cache = VerdictCache(settings.VERDICT_CACHE_SIZE, settings.VERDICT_CACHE_TTL_S)